@@ -0,0 +1,168 @@
+import json
+import logging
+import struct
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from test import BINARIZE_THRESHOLD, GLITCH_IGNORE_THRESHOLD, MAE_THRESHOLD, debounce_change_events
+
+# magic, version, frames, height, width, fps, roi top/bottom/left/right, padded to HEADER_SIZE bytes
+HEADER = struct.Struct('<8sIQIId4i')
+HEADER_SIZE = 64
+MAGIC = b'SUBBAND1'
+VERSION = 1
+
+# Frames per vectorized batch, bounds the temporary arrays regardless of video length
+DIFF_BATCH_FRAMES = 512
+
+
+class BandStoreWriter:
+    """Appends grayscale subtitle bands (uint8, height x width) to a memory-mapped frames x h x w file."""
+
+    def __init__(self, path, capacity: int, height: int, width: int, fps: float, roi: Dict[str, int]):
+        self.path = str(path)
+        self.height = height
+        self.width = width
+        self.fps = fps
+        self.roi = roi
+        self.count = 0
+        self.capacity = 0
+        self.bands = None
+        with open(self.path, 'wb') as f:
+            f.write(self.header(0))
+        self.grow(max(capacity, 1))
+
+    def header(self, frames: int) -> bytes:
+        packed = HEADER.pack(
+            MAGIC, VERSION, frames, self.height, self.width, self.fps,
+            self.roi['top'], self.roi['bottom'], self.roi['left'], self.roi['right']
+        )
+        return packed.ljust(HEADER_SIZE, b'\0')
+
+    def grow(self, capacity: int):
+        if self.bands is not None:
+            self.bands.flush()
+            del self.bands
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + capacity * self.height * self.width)
+        self.bands = np.memmap(self.path, dtype=np.uint8, mode='r+', offset=HEADER_SIZE,
+                               shape=(capacity, self.height, self.width))
+        self.capacity = capacity
+
+    def append(self, band: np.ndarray):
+        # The container frame count is only an estimate
+        if self.count == self.capacity:
+            self.grow(self.capacity + max(self.capacity // 10, 64))
+        self.bands[self.count] = band
+        self.count += 1
+
+    def close(self):
+        if self.bands is None:
+            return
+        self.bands.flush()
+        del self.bands
+        self.bands = None
+        with open(self.path, 'r+b') as f:
+            f.write(self.header(self.count))
+            f.truncate(HEADER_SIZE + self.count * self.height * self.width)
+        logging.info(f"Stored {self.count} subtitle bands of {self.width}x{self.height} in {self.path}")
+
+
+def open_band_store(path) -> Tuple[np.memmap, Dict]:
+    """Map a band store read-only and return the (frames, height, width) array with its metadata."""
+    with open(path, 'rb') as f:
+        magic, version, frames, height, width, fps, top, bottom, left, right = HEADER.unpack(
+            f.read(HEADER_SIZE)[:HEADER.size]
+        )
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a subtitle band store")
+    meta = {
+        'frames': frames, 'height': height, 'width': width, 'fps': fps,
+        'roi': {'top': top, 'bottom': bottom, 'left': left, 'right': right},
+    }
+    if frames == 0:
+        return np.zeros((0, height, width), dtype=np.uint8), meta
+    bands = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_SIZE, shape=(frames, height, width))
+    return bands, meta
+
+
+def band_differences(bands: np.ndarray, binarize_threshold: int = BINARIZE_THRESHOLD, metric: str = 'binary') -> np.ndarray:
+    """Difference of every frame to the previous one, as a percentage (index i is frame i + 1).
+
+    'binary' is what split_by_computer_vision computes: the share of pixels whose thresholded
+    value changed. 'mae' is the mean absolute grayscale difference scaled to 0-100.
+    """
+    frames = len(bands)
+    differences = np.empty(max(frames - 1, 0), dtype=np.float64)
+    for start in range(1, frames, DIFF_BATCH_FRAMES):
+        end = min(start + DIFF_BATCH_FRAMES, frames)
+        window = bands[start - 1:end]
+        if metric == 'binary':
+            binary = window > binarize_threshold
+            changed = binary[1:] != binary[:-1]
+            differences[start - 1:end - 1] = changed.mean(axis=(1, 2)) * 100
+        elif metric == 'mae':
+            window = window.astype(np.int16)
+            differences[start - 1:end - 1] = np.abs(window[1:] - window[:-1]).mean(axis=(1, 2)) * 100 / 255
+        else:
+            raise ValueError(f"Unknown difference metric: {metric}")
+    return differences
+
+
+def change_events_from_differences(differences: np.ndarray, fps: float, threshold: float = MAE_THRESHOLD,
+                                   glitch_threshold: float = GLITCH_IGNORE_THRESHOLD) -> List[Dict]:
+    # Only frames above the threshold can become events, skip the rest without building records
+    frame_numbers = np.flatnonzero(differences > threshold) + 1
+    records = (
+        {'frame_number': int(frame_number), 'timestamp': int(frame_number) / fps, 'confidence': float(differences[frame_number - 1])}
+        for frame_number in frame_numbers
+    )
+    return list(debounce_change_events(records, threshold, glitch_threshold))
+
+
+def sweep_parameters(path, parameter_sets: List[Dict]) -> List[Dict]:
+    """Evaluate many detection parameter sets against one band store.
+
+    Each set may contain 'binarize_threshold', 'metric', 'threshold' and 'glitch_threshold';
+    differences are computed once per (binarize_threshold, metric) pair.
+    """
+    bands, meta = open_band_store(path)
+    differences_by_key = {}
+    results = []
+    for parameters in parameter_sets:
+        key = (parameters.get('binarize_threshold', BINARIZE_THRESHOLD), parameters.get('metric', 'binary'))
+        if key not in differences_by_key:
+            differences_by_key[key] = band_differences(bands, *key)
+        events = change_events_from_differences(
+            differences_by_key[key], meta['fps'],
+            parameters.get('threshold', MAE_THRESHOLD), parameters.get('glitch_threshold', GLITCH_IGNORE_THRESHOLD)
+        )
+        results.append({'parameters': parameters, 'events': events})
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    from test import configure_logging, parse_subtitle_roi, split_by_computer_vision
+
+    parser = argparse.ArgumentParser(description="Store subtitle bands once, then sweep detection parameters")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    scan_parser = subparsers.add_parser("scan", help="Decode a video once and store its subtitle bands")
+    scan_parser.add_argument("video")
+    scan_parser.add_argument("store")
+    scan_parser.add_argument("--subtitle_roi", "-roi", default=None, type=parse_subtitle_roi)
+    sweep_parser = subparsers.add_parser("sweep", help="Evaluate parameter sets (JSON list) against a store")
+    sweep_parser.add_argument("store")
+    sweep_parser.add_argument("parameter_sets", help="JSON file with a list of parameter sets")
+
+    args = parser.parse_args()
+    configure_logging()
+    if args.command == "scan":
+        split_by_computer_vision(args.video, args.subtitle_roi, band_store=args.store)
+    else:
+        with open(args.parameter_sets, 'r') as f:
+            parameter_sets = json.load(f)
+        for result in sweep_parameters(args.store, parameter_sets):
+            print(json.dumps({'parameters': result['parameters'], 'changes': len(result['events']),
+                              'timestamps': [round(event['timestamp'], 3) for event in result['events']]}))
@@ -0,0 +1,224 @@
+import csv
+import json
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from workers import make_process_pool
+
+STAGES: List[str] = ['align', 'scan', 'render']
+REQUIRED_FIELDS: List[str] = ['input_clips', 'input_video', 'input_mp3', 'input_txt', 'output_dir']
+
+
+def load_manifest(manifest_path: Path) -> List[Dict]:
+    """Read projects from a JSON list (or {"projects": [...]}) or a CSV with one project per row."""
+    if manifest_path.suffix.lower() == '.csv':
+        with open(manifest_path, newline='') as f:
+            projects = [dict(row) for row in csv.DictReader(f)]
+    else:
+        with open(manifest_path, 'r') as f:
+            projects = json.load(f)
+        if isinstance(projects, dict):
+            projects = projects['projects']
+
+    names = set()
+    for index, project in enumerate(projects):
+        missing = [field for field in REQUIRED_FIELDS if not project.get(field)]
+        if missing:
+            raise ValueError(f"Project #{index + 1} in {manifest_path} is missing {', '.join(missing)}")
+        project.setdefault('name', Path(project['output_dir']).name or f"project_{index + 1}")
+        if project['name'] in names:
+            raise ValueError(f"Duplicate project name in {manifest_path}: {project['name']}")
+        names.add(project['name'])
+    return projects
+
+
+def run_align(project: Dict) -> Dict:
+    from test import generate_srt_from_txt_and_audio
+
+    output_folder = Path(project['output_dir'])
+    output_folder.mkdir(parents=True, exist_ok=True)
+    srt_file = generate_srt_from_txt_and_audio(Path(project['input_txt']), Path(project['input_mp3']), output_folder)
+    return {'srt_file': str(srt_file)}
+
+
+def run_scan(project: Dict) -> Dict:
+    from test import iter_subtitle_change_events, parse_subtitle_roi
+
+    roi = parse_subtitle_roi(project['subtitle_roi']) if project.get('subtitle_roi') else None
+    events = list(iter_subtitle_change_events(project['input_video'], roi))
+    events_file = Path(project['output_dir']) / 'change_events.json'
+    with open(events_file, 'w') as f:
+        json.dump(events, f)
+    return {'events_file': str(events_file)}
+
+
+def run_render(project: Dict, srt_file: str, events_file: str) -> Dict:
+    from renditions import parse_renditions
+    from test import main
+
+    with open(events_file, 'r') as f:
+        change_events = json.load(f)
+    output_files = main(
+        project['input_clips'], project['input_video'], project['input_mp3'], project['input_txt'],
+        Path(project['output_dir']), project['font_file'], int(project['font_size']), project['font_color'],
+        project['bg_color'], int(project['margin']), project['render_backend'], srt_file=srt_file,
+        change_events=change_events, render_chunks=int(project.get('render_chunks', 0)),
+        renditions=parse_renditions(project.get('renditions') or '')
+    )
+    return {'output_files': [str(output_file) for output_file in output_files]}
+
+
+def timed(stage_function, *args) -> Dict:
+    start = time.perf_counter()
+    result = stage_function(*args)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def stage_outputs_exist(stage: str, record: Dict) -> bool:
+    outputs = {
+        'align': [record.get('srt_file')],
+        'scan': [record.get('events_file')],
+        'render': record.get('output_files') or [None],
+    }[stage]
+    return all(output and os.path.exists(output) for output in outputs)
+
+
+class BatchState:
+    """Per-project stage progress persisted after every transition so a crashed batch can resume."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.projects: Dict[str, Dict] = {}
+        if path.exists():
+            with open(path, 'r') as f:
+                self.projects = json.load(f)
+
+    def project(self, name: str) -> Dict:
+        return self.projects.setdefault(name, {'stages': {}})
+
+    def stage(self, name: str, stage: str) -> Dict:
+        return self.project(name)['stages'].setdefault(stage, {'status': 'pending', 'attempts': 0})
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.projects, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def run_batch(
+    manifest_path: Path,
+    state_file: Optional[str],
+    defaults: Dict,
+    align_workers: int,
+    scan_workers: int,
+    render_workers: int,
+    retries: int = 2,
+) -> Dict:
+    projects = [dict(defaults, **{k: v for k, v in project.items() if v not in (None, '')})
+                for project in load_manifest(manifest_path)]
+    state = BatchState(Path(state_file) if state_file else manifest_path.with_suffix('.state.json'))
+    pools = {
+        'align': make_process_pool(align_workers),
+        'scan': make_process_pool(scan_workers),
+        'render': make_process_pool(render_workers),
+    }
+    batch_start = time.perf_counter()
+    running = {}
+    # Retries are counted per run, a resumed batch gives failed stages a fresh set of attempts
+    attempts = Counter()
+
+    def submit(project: Dict, stage: str):
+        name = project['name']
+        record = state.project(name)
+        stage_state = state.stage(name, stage)
+        if stage_state['status'] == 'done' and stage_outputs_exist(stage, record):
+            logging.info(f"[{name}] {stage} already done, skipping")
+            advance(project, stage)
+            return
+        stage_state['status'] = 'running'
+        stage_state['attempts'] += 1
+        attempts[(name, stage)] += 1
+        state.save()
+        if stage == 'align':
+            future = pools['align'].submit(timed, run_align, project)
+        elif stage == 'scan':
+            future = pools['scan'].submit(timed, run_scan, project)
+        else:
+            future = pools['render'].submit(timed, run_render, project, record['srt_file'], record['events_file'])
+        running[future] = (project, stage)
+
+    def advance(project: Dict, stage: str):
+        next_index = STAGES.index(stage) + 1
+        if next_index < len(STAGES):
+            submit(project, STAGES[next_index])
+
+    try:
+        for project in projects:
+            submit(project, 'align')
+
+        while running:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                project, stage = running.pop(future)
+                name = project['name']
+                stage_state = state.stage(name, stage)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    stage_state['error'] = str(e)
+                    if attempts[(name, stage)] <= retries:
+                        logging.warning(f"[{name}] {stage} failed (attempt {stage_state['attempts']}), retrying: {e}")
+                        submit(project, stage)
+                    else:
+                        logging.error(f"[{name}] {stage} failed after {stage_state['attempts']} attempts: {e}")
+                        stage_state['status'] = 'failed'
+                        state.save()
+                    continue
+                stage_state.update(status='done', seconds=result.pop('seconds'), error=None)
+                state.project(name).update(result)
+                state.save()
+                logging.info(f"[{name}] {stage} done in {stage_state['seconds']:.1f}s")
+                advance(project, stage)
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+
+    report = build_report(projects, state, time.perf_counter() - batch_start)
+    report_file = state.path.with_name(manifest_path.stem + '_report.json')
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    for row in report['projects']:
+        timings = ', '.join(f"{stage} {seconds:.1f}s" for stage, seconds in row['seconds'].items())
+        logging.info(f"{row['name']}: {row['status']} ({timings}){' - ' + row['error'] if row['error'] else ''}")
+    logging.info(f"Batch finished: {report['succeeded']} succeeded, {report['failed']} failed "
+                 f"in {report['wall_seconds']:.1f}s, report written to {report_file}")
+    return report
+
+
+def build_report(projects: List[Dict], state: BatchState, wall_seconds: float) -> Dict:
+    rows = []
+    for project in projects:
+        record = state.project(project['name'])
+        stages = record['stages']
+        failed = [stage for stage in STAGES if stages.get(stage, {}).get('status') == 'failed']
+        rows.append({
+            'name': project['name'],
+            'status': 'failed' if failed else 'done' if stages.get('render', {}).get('status') == 'done' else 'incomplete',
+            'seconds': {stage: stages[stage]['seconds'] for stage in STAGES if stages.get(stage, {}).get('seconds') is not None},
+            'attempts': {stage: stages[stage]['attempts'] for stage in STAGES if stage in stages},
+            'error': stages[failed[0]].get('error') if failed else None,
+            'output_files': record.get('output_files', []),
+        })
+    return {
+        'wall_seconds': wall_seconds,
+        'succeeded': sum(row['status'] == 'done' for row in rows),
+        'failed': sum(row['status'] == 'failed' for row in rows),
+        'projects': rows,
+    }
@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+CACHE_ROOT = Path(os.environ.get('CACHE_DIR', 'cache'))
+FILE_HASH_MEMO_ENTRIES = int(os.environ.get('FILE_HASH_MEMO_ENTRIES', 1024))
+
+# resolved path -> (size, mtime, sha256), so unchanged files are only hashed once per process.
+# One entry per path (a rewritten file replaces its stale hash), least recently used paths dropped first.
+_file_hashes: 'OrderedDict[str, Tuple[int, int, str]]' = OrderedDict()
+_file_hashes_lock = threading.Lock()
+
+
+def file_hash(path) -> str:
+    path = Path(path)
+    stat = path.stat()
+    memo_key = str(path.resolve())
+    with _file_hashes_lock:
+        memo = _file_hashes.get(memo_key)
+        if memo is not None and memo[:2] == (stat.st_size, stat.st_mtime_ns):
+            _file_hashes.move_to_end(memo_key)
+            return memo[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    with _file_hashes_lock:
+        _file_hashes[memo_key] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+        _file_hashes.move_to_end(memo_key)
+        while len(_file_hashes) > FILE_HASH_MEMO_ENTRIES:
+            _file_hashes.popitem(last=False)
+    return digest.hexdigest()
+
+
+def cache_path(namespace: str, name: str) -> Path:
+    directory = CACHE_ROOT / namespace
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / name
+
+
+def load_cached_json(namespace: str, key: str) -> Optional[Any]:
+    path = cache_path(namespace, f"{key}.json")
+    if not path.exists():
+        return None
+    try:
+        with open(path, 'r') as f:
+            value = json.load(f)
+        # Mark the entry as used for the janitor, which may run in another process
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return value
+
+
+def save_cached_json(namespace: str, key: str, value: Any) -> Path:
+    path = cache_path(namespace, f"{key}.json")
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+    return path
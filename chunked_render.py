@@ -0,0 +1,165 @@
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import wait
+from pathlib import Path
+from typing import Dict, List
+
+from dirqueue import DirectoryQueue
+from ffmpeg_backend import AUDIO_ENCODER_ARGS, FFMPEG_BINARY, VIDEO_ENCODER_ARGS, render_plan_with_ffmpeg
+from workers import make_process_pool
+
+CHUNK_LEASE_SECONDS = float(os.environ.get('CHUNK_LEASE_SECONDS', 3600))
+# Workers renew their lease this many times per lease period while a chunk renders
+CHUNK_HEARTBEATS_PER_LEASE = 4
+# Longest a chunked render waits for its chunks, including ones claimed by workers on other machines
+CHUNK_RENDER_TIMEOUT = float(os.environ.get('CHUNK_RENDER_TIMEOUT', 2 * CHUNK_LEASE_SECONDS))
+
+
+def split_plan_into_chunks(plan: Dict, chunk_count: int) -> List[Dict]:
+    """Group consecutive plan segments into at most chunk_count video-only plans of similar duration."""
+    total = sum(segment['duration'] for segment in plan['segments'])
+    target = total / max(chunk_count, 1)
+    chunks = []
+    current = []
+    elapsed = 0.0
+    for segment in plan['segments']:
+        current.append(segment)
+        elapsed += segment['duration']
+        if elapsed >= target * (len(chunks) + 1) and len(chunks) < chunk_count - 1:
+            chunks.append(current)
+            current = []
+    if current:
+        chunks.append(current)
+    return [dict(plan, segments=segments, has_audio=False) for segments in chunks]
+
+
+def render_chunk(task: Dict) -> Dict:
+    # Every chunk uses the same backend and encoder settings, so the outputs concatenate without re-encoding
+    if task['backend'] == 'ffmpeg':
+        render_plan_with_ffmpeg(task['plan'], task['output'], video_args=VIDEO_ENCODER_ARGS)
+    elif task['backend'] == 'zerocopy':
+        from frame_io import render_plan_zero_copy
+
+        render_plan_zero_copy(task['plan'], task['output'], video_args=VIDEO_ENCODER_ARGS)
+    else:
+        from pipelined_writer import write_clip_pipelined
+        from test import build_clip_from_plan
+
+        clip = build_clip_from_plan(task['plan'])
+        write_clip_pipelined(clip, task['output'], fps=task['plan']['fps'], audio=False)
+        clip.close()
+    return {'output': task['output']}
+
+
+def run_chunk_worker(queue_dir, lease_seconds: float = CHUNK_LEASE_SECONDS) -> int:
+    """Render chunks from the queue until it is empty and return how many this worker rendered."""
+    queue = DirectoryQueue(queue_dir)
+    rendered = 0
+    while True:
+        queue.requeue_stale(lease_seconds)
+        task = queue.claim()
+        if task is None:
+            return rendered
+        logging.info(f"Worker {queue.worker_id} rendering chunk {task['index']}")
+        try:
+            with queue.leased(task, lease_seconds / CHUNK_HEARTBEATS_PER_LEASE):
+                result = render_chunk(task)
+            queue.complete(task, result)
+            rendered += 1
+        except Exception as e:
+            logging.error(f"Chunk {task['index']} failed: {e}")
+            queue.fail(task, str(e))
+
+
+def concat_chunks(chunk_files: List[str], plan: Dict, output_path, work_dir: Path) -> Path:
+    list_file = work_dir / 'chunks.txt'
+    with open(list_file, 'w') as f:
+        for chunk_file in chunk_files:
+            f.write(f"file '{Path(chunk_file).resolve().as_posix()}'\n")
+
+    total = sum(segment['duration'] for segment in plan['segments'])
+    command = [FFMPEG_BINARY, '-y', '-hide_banner', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', str(list_file)]
+    if plan['has_audio']:
+        command += ['-ss', f"{plan.get('audio_start', 0.0):.6f}", '-t', f"{total:.6f}", '-i', plan['video'],
+                    '-map', '0:v', '-map', '1:a:0'] + AUDIO_ENCODER_ARGS
+    command += ['-c:v', 'copy', str(output_path)]
+    logging.debug(f"Running command: {' '.join(command)}")
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg concat failed: {result.stderr.decode('utf-8')}")
+    return Path(output_path)
+
+
+def render_plan_chunked(
+    plan: Dict,
+    output_path,
+    chunk_count: int,
+    backend: str = 'moviepy',
+    workers: int = None,
+    queue_dir=None,
+    timeout: float = CHUNK_RENDER_TIMEOUT,
+) -> Path:
+    """Render the plan as independently encoded chunks in parallel worker processes and join them losslessly.
+
+    Chunks are handed out through a DirectoryQueue; pass a queue_dir on a shared filesystem to let
+    `python chunked_render.py <queue_dir>` workers on other machines help.
+    """
+    work_dir = Path(queue_dir) if queue_dir is not None else Path(tempfile.mkdtemp(prefix='chunked_render_'))
+    (work_dir / 'chunks').mkdir(parents=True, exist_ok=True)
+    queue = DirectoryQueue(work_dir / 'queue')
+
+    try:
+        chunks = split_plan_into_chunks(plan, chunk_count)
+        task_ids = []
+        for index, chunk_plan in enumerate(chunks):
+            output = (work_dir / 'chunks' / f"chunk_{index:04d}.mp4").as_posix()
+            task_ids.append(queue.put({'index': index, 'plan': chunk_plan, 'output': output, 'backend': backend}))
+        logging.info(f"Queued {len(chunks)} chunks in {work_dir}")
+
+        start = time.time()
+        pool = make_process_pool(min(workers or os.cpu_count(), len(chunks)))
+        try:
+            futures = [pool.submit(run_chunk_worker, queue.root) for _ in range(pool._max_workers)]
+            wait(futures)
+        finally:
+            pool.shutdown()
+        # A worker that died (e.g. killed for memory) would hold its chunk until the lease runs out, fail now instead
+        for future in futures:
+            error = future.exception()
+            if error is not None:
+                raise RuntimeError(f"A chunk worker died: {error!r}") from error
+
+        # Chunks claimed by workers on other machines may still be running
+        while set(task_ids) - set(queue.ids('done')):
+            failed = set(task_ids) & set(queue.ids('failed'))
+            if failed:
+                errors = [queue.load('failed', task_id)['error'] for task_id in failed]
+                raise RuntimeError(f"{len(failed)} chunks failed to render: {errors}")
+            if timeout is not None and time.time() - start > timeout:
+                raise TimeoutError(f"Chunked render did not finish within {timeout} seconds")
+            if queue.requeue_stale(CHUNK_LEASE_SECONDS) or queue.ids('pending'):
+                run_chunk_worker(queue.root)
+            time.sleep(1)
+
+        chunk_files = [queue.load('done', task_id)['output'] for task_id in task_ids]
+        concat_chunks(chunk_files, plan, output_path, work_dir)
+        logging.info(f"Generated output video: {output_path} from {len(chunk_files)} chunks")
+    finally:
+        if queue_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return Path(output_path)
+
+
+if __name__ == "__main__":
+    from test import configure_logging
+
+    configure_logging()
+    if len(sys.argv) != 2:
+        sys.exit(f"usage: {sys.argv[0]} QUEUE_DIR")
+    count = run_chunk_worker(Path(sys.argv[1]) / 'queue')
+    logging.info(f"Rendered {count} chunks")
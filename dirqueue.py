@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class DirectoryQueue:
+    """A task queue kept as JSON files in a directory, safe for workers on any machine sharing the filesystem.
+
+    Tasks move pending/ -> claimed/ -> done/ (or failed/). Claiming is an atomic rename,
+    so exactly one worker wins each task.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        for state in ('pending', 'claimed', 'done', 'failed'):
+            (self.root / state).mkdir(parents=True, exist_ok=True)
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+    def _write(self, path: Path, value: Dict):
+        tmp_path = self.root / f".{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def put(self, task: Dict) -> str:
+        task_id = task.setdefault('id', uuid.uuid4().hex)
+        self._write(self.root / 'pending' / f"{task_id}.json", task)
+        return task_id
+
+    def claim(self) -> Optional[Dict]:
+        for path in sorted((self.root / 'pending').glob('*.json')):
+            claimed_path = self.root / 'claimed' / path.name
+            try:
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                # Another worker claimed it first
+                continue
+            os.utime(claimed_path)
+            with open(claimed_path, 'r') as f:
+                task = json.load(f)
+            task['worker'] = self.worker_id
+            return task
+        return None
+
+    def renew(self, task: Dict) -> bool:
+        """Extend the lease on a claimed task, False if it is no longer claimed here (it was requeued)."""
+        try:
+            os.utime(self.root / 'claimed' / f"{task['id']}.json")
+        except FileNotFoundError:
+            return False
+        return True
+
+    @contextmanager
+    def leased(self, task: Dict, interval: float):
+        """Renew the task's lease every interval seconds while the block runs, so long tasks are not requeued."""
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(interval):
+                if not self.renew(task):
+                    logging.warning(f"Lost the lease on task {task['id']}, it was requeued")
+                    return
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, task: Dict, result: Dict = None):
+        task['result'] = result or {}
+        self._write(self.root / 'done' / f"{task['id']}.json", task)
+        (self.root / 'claimed' / f"{task['id']}.json").unlink(missing_ok=True)
+
+    def fail(self, task: Dict, error: str):
+        task['error'] = error
+        self._write(self.root / 'failed' / f"{task['id']}.json", task)
+        (self.root / 'claimed' / f"{task['id']}.json").unlink(missing_ok=True)
+
+    def requeue_stale(self, lease_seconds: float) -> int:
+        """Put back tasks whose worker has held them longer than the lease (e.g. it crashed)."""
+        requeued = 0
+        for path in (self.root / 'claimed').glob('*.json'):
+            try:
+                if time.time() - path.stat().st_mtime > lease_seconds:
+                    os.rename(path, self.root / 'pending' / path.name)
+                    requeued += 1
+            except FileNotFoundError:
+                continue
+        return requeued
+
+    def ids(self, state: str) -> List[str]:
+        return [path.stem for path in (self.root / state).glob('*.json')]
+
+    def load(self, state: str, task_id: str) -> Dict:
+        with open(self.root / state / f"{task_id}.json", 'r') as f:
+            return json.load(f)
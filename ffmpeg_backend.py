@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from keyframes import KEYFRAME_SNAP_SECONDS, get_keyframe_index, snap_to_keyframe
+from test import aspect_crop_box, cached_subtitle_overlay, subriptime_to_seconds, subtitle_overlay_position
+
+if TYPE_CHECKING:
+    import pysrt
+
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = os.environ.get('FFPROBE_BINARY', 'ffprobe')
+
+# Same encoder settings moviepy uses for write_videofile(codec="libx264", audio_codec="aac")
+VIDEO_ENCODER_ARGS: List[str] = ['-c:v', 'libx264', '-preset', 'medium', '-pix_fmt', 'yuv420p']
+AUDIO_ENCODER_ARGS: List[str] = ['-c:a', 'aac']
+# Previews favour encode latency over size and quality
+PREVIEW_VIDEO_ARGS: List[str] = ['-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency', '-crf', '28',
+                                 '-pix_fmt', 'yuv420p', '-movflags', '+faststart']
+PREVIEW_HEIGHT = int(os.environ.get('PREVIEW_HEIGHT', 480))
+PREVIEW_CONTEXT_SECONDS = float(os.environ.get('PREVIEW_CONTEXT_SECONDS', 1.0))
+
+
+def probe_video(path) -> Dict:
+    command = [
+        FFPROBE_BINARY, '-v', 'error', '-show_streams', '-show_format', '-of', 'json', str(path)
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {path}: {result.stderr.decode('utf-8')}")
+    info = json.loads(result.stdout)
+
+    video_stream = next((s for s in info['streams'] if s['codec_type'] == 'video'), None)
+    if video_stream is None:
+        raise ValueError(f"No video stream found in {path}")
+    num, den = video_stream.get('avg_frame_rate', '0/0').split('/')
+    if float(den) == 0 or float(num) == 0:
+        num, den = video_stream['r_frame_rate'].split('/')
+
+    return {
+        'width': int(video_stream['width']),
+        'height': int(video_stream['height']),
+        'fps': float(num) / float(den),
+        'duration': float(info['format']['duration']),
+        'has_audio': any(s['codec_type'] == 'audio' for s in info['streams']),
+    }
+
+
+def source_segment(video_path, start: float, end: float, duration: float) -> Dict:
+    """Plan segment of the original video."""
+    return {
+        'source': str(video_path),
+        'start': start,
+        'end': end,
+        'duration': duration,
+        'crop': None,
+        'subtitle': None,
+    }
+
+
+def build_render_plan(
+    video_path,
+    subtitles: pysrt.SubRipFile,
+    replacements: Dict[int, str],
+    font_path: str,
+    font_size: int,
+    font_color: str,
+    bg_color: str,
+    margin: int,
+    segment_durations: Optional[List[float]] = None,
+    aspect_ratio: Optional[float] = None,
+    keyframe_snap: float = KEYFRAME_SNAP_SECONDS,
+) -> Dict:
+    """Describe the edited timeline as plain data that any render backend can consume.
+
+    With a keyframe_snap above 0, cuts within that many seconds of a source keyframe are moved onto it.
+    """
+    source = probe_video(video_path)
+    if aspect_ratio is None:
+        aspect_ratio = source['width'] / source['height']
+    keyframe_index = get_keyframe_index(video_path) if keyframe_snap > 0 else None
+
+    segments = []
+    shift = 0.0
+    for index, subtitle in enumerate(subtitles):
+        start = snap_to_keyframe(keyframe_index, subriptime_to_seconds(subtitle.start), keyframe_snap)
+        unsnapped_end = subriptime_to_seconds(subtitle.end)
+        end = snap_to_keyframe(keyframe_index, unsnapped_end, keyframe_snap)
+        if segment_durations is not None:
+            # Durations given for the unsnapped cuts follow the original audio, move each boundary with its cut
+            duration = segment_durations[index] + (end - unsnapped_end) - shift
+            shift = end - unsnapped_end
+        else:
+            duration = end - start
+
+        if index in replacements:
+            replacement = probe_video(replacements[index])
+            # Always crop the replacement to the subtitle length, from 0
+            length = min(end - start, replacement['duration'])
+            segments.append({
+                'source': str(replacements[index]),
+                'start': 0.0,
+                'end': length,
+                'duration': duration,
+                'crop': list(aspect_crop_box(replacement['width'], replacement['height'], aspect_ratio)),
+                'subtitle': {'text': subtitle.text, 'duration': end - start},
+            })
+        else:
+            segments.append(source_segment(video_path, start, end, duration))
+
+    return {
+        'video': str(video_path),
+        'width': source['width'],
+        'height': source['height'],
+        'fps': source['fps'],
+        'has_audio': source['has_audio'],
+        'style': {
+            'font_path': str(font_path),
+            'font_size': font_size,
+            'font_color': font_color,
+            'bg_color': bg_color,
+            'margin': margin,
+        },
+        'segments': segments,
+    }
+
+
+def build_preview_plan(
+    video_path,
+    subtitles: pysrt.SubRipFile,
+    srt_index: int,
+    replacement_path,
+    font_path: str,
+    font_size: int,
+    font_color: str,
+    bg_color: str,
+    margin: int,
+    context: float = PREVIEW_CONTEXT_SECONDS,
+    keyframe_snap: float = KEYFRAME_SNAP_SECONDS,
+) -> Dict:
+    """Plan only the replaced segment of srt_index with a little of the original video on each side."""
+    plan = build_render_plan(
+        video_path, subtitles[srt_index:srt_index + 1], {0: replacement_path},
+        font_path, font_size, font_color, bg_color, margin, keyframe_snap=keyframe_snap
+    )
+    replaced = plan['segments'][0]
+    keyframe_index = get_keyframe_index(video_path) if keyframe_snap > 0 else None
+    start = snap_to_keyframe(keyframe_index, subriptime_to_seconds(subtitles[srt_index].start), keyframe_snap)
+    end = snap_to_keyframe(keyframe_index, subriptime_to_seconds(subtitles[srt_index].end), keyframe_snap)
+    before = max(0.0, start - context)
+    after = min(probe_video(video_path)['duration'], end + context)
+
+    segments = []
+    if start > before:
+        segments.append(source_segment(video_path, before, start, start - before))
+    segments.append(replaced)
+    if after > end:
+        segments.append(source_segment(video_path, end, after, after - end))
+    # The audio follows the original timeline from the first context frame
+    return dict(plan, segments=segments, audio_start=before)
+
+
+def segment_input_args(segment: Dict) -> List[str]:
+    """Input options reading a segment's source range.
+
+    An input -ss is an accurate seek: ffmpeg starts decoding at the keyframe before it and drops the frames up to it.
+    """
+    return ['-ss', f"{segment['start']:.6f}", '-t', f"{segment['end'] - segment['start']:.6f}", '-i', segment['source']]
+
+
+def segment_filter_chain(segment: Dict, width: int, height: int, fps: float) -> List[str]:
+    filters = []
+    if segment['crop'] is not None:
+        x1, y1, x2, y2 = segment['crop']
+        filters.append(f"crop={x2 - x1}:{y2 - y1}:{x1}:{y1}")
+    filters += [f"scale={width}:{height}", "setsar=1", f"fps={fps}"]
+
+    length = segment['end'] - segment['start']
+    if segment['duration'] > length:
+        # Loop the decoded frames of the range until the segment is long enough
+        loop_size = max(1, int(math.ceil(length * fps)))
+        filters.append(f"loop=loop=-1:size={loop_size}:start=0")
+    filters += [f"trim=duration={segment['duration']:.6f}", "setpts=PTS-STARTPTS"]
+    return filters
+
+
+def fan_out_filters(source_label: str, chains: List[Optional[List[str]]]) -> Tuple[List[str], List[str]]:
+    """Filters giving every output its own copy of source_label (so it is composited once), and their labels."""
+    source_labels = [source_label]
+    filters = []
+    if len(chains) > 1:
+        source_labels = [f"[split{i}]" for i in range(len(chains))]
+        filters.append(f"{source_label}split={len(chains)}{''.join(source_labels)}")
+    output_labels = []
+    for i, chain in enumerate(chains):
+        if chain:
+            filters.append(f"{source_labels[i]}{','.join(chain)}[vout{i}]")
+            output_labels.append(f"[vout{i}]")
+        else:
+            output_labels.append(source_labels[i])
+    return filters, output_labels
+
+
+def build_ffmpeg_command(
+    plan: Dict,
+    output_path,
+    video_args: List[str] = VIDEO_ENCODER_ARGS,
+    audio_args: List[str] = AUDIO_ENCODER_ARGS,
+    output_filters: Optional[List[str]] = None,
+    extra_outputs: Optional[List[Tuple[Any, List[str]]]] = None,
+) -> List[str]:
+    """ffmpeg command rendering the plan to output_path, plus (path, filters) extra_outputs from the same composite."""
+    width, height, fps = plan['width'], plan['height'], plan['fps']
+    style = plan['style']
+
+    inputs = []
+    filters = []
+    segment_labels = []
+    overlays = []
+    timeline = 0.0
+    for i, segment in enumerate(plan['segments']):
+        input_index = len(inputs)
+        inputs.append(segment_input_args(segment))
+        chain = ','.join(segment_filter_chain(segment, width, height, fps))
+        filters.append(f"[{input_index}:v]{chain}[v{i}]")
+        segment_labels.append(f"[v{i}]")
+
+        if segment['subtitle'] is not None:
+            # The overlay PNG comes straight from the disk cache
+            overlay, overlay_path = cached_subtitle_overlay(
+                segment['subtitle']['text'], width, style['font_path'], style['font_size'],
+                style['font_color'], style['bg_color'], style['margin']
+            )
+            x, y = subtitle_overlay_position(overlay, width, height, style['margin'])
+            subtitle_end = timeline + min(segment['subtitle']['duration'], segment['duration'])
+            overlays.append((overlay_path, x, y, timeline, subtitle_end))
+        timeline += segment['duration']
+
+    filters.append(f"{''.join(segment_labels)}concat=n={len(segment_labels)}:v=1:a=0[base0]")
+    for i, (overlay_path, x, y, start, end) in enumerate(overlays):
+        input_index = len(inputs)
+        inputs.append(['-i', str(overlay_path)])
+        filters.append(
+            f"[base{i}][{input_index}:v]overlay=x={x}:y={y}:enable='between(t,{start:.6f},{end:.6f})'[base{i + 1}]"
+        )
+    outputs = [(output_path, output_filters)] + list(extra_outputs or [])
+    output_filter_graph, output_labels = fan_out_filters(f"[base{len(overlays)}]", [chain for _, chain in outputs])
+    filters += output_filter_graph
+
+    command = [FFMPEG_BINARY, '-y', '-hide_banner', '-loglevel', 'error']
+    for input_args in inputs:
+        command += input_args
+    audio_index = None
+    if plan['has_audio']:
+        audio_index = len(inputs)
+        command += ['-ss', f"{plan.get('audio_start', 0.0):.6f}", '-t', f"{timeline:.6f}", '-i', plan['video']]
+
+    command += ['-filter_complex', ';'.join(filters)]
+    for (path, _), label in zip(outputs, output_labels):
+        command += ['-map', label]
+        if audio_index is not None:
+            command += ['-map', f"{audio_index}:a:0"] + audio_args
+        command += video_args + ['-r', str(fps), str(path)]
+    return command
+
+
+def render_plan_with_ffmpeg(
+    plan: Dict,
+    output_path,
+    video_args: List[str] = VIDEO_ENCODER_ARGS,
+    audio_args: List[str] = AUDIO_ENCODER_ARGS,
+    output_filters: Optional[List[str]] = None,
+    extra_outputs: Optional[List[Tuple[Any, List[str]]]] = None,
+) -> Path:
+    """Render the plan with a single ffmpeg filter_complex invocation."""
+    command = build_ffmpeg_command(plan, output_path, video_args, audio_args, output_filters, extra_outputs)
+    logging.info(f"Running ffmpeg render for {len(plan['segments'])} segments into {output_path}")
+    logging.debug(f"Running command: {' '.join(command)}")
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg render failed: {result.stderr.decode('utf-8')}")
+    logging.info(f"Generated output video: {output_path}")
+    for path, _ in extra_outputs or []:
+        logging.info(f"Generated rendition: {path}")
+    return Path(output_path)
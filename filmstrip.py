@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+FILMSTRIP_INTERVAL_SECONDS = float(os.environ.get('FILMSTRIP_INTERVAL_SECONDS', 1.0))
+FILMSTRIP_TILE_HEIGHT = int(os.environ.get('FILMSTRIP_TILE_HEIGHT', 90))
+# Tiles per sprite sheet row and per sheet, small sheets keep every image well under JPEG size limits
+FILMSTRIP_COLUMNS = 10
+FILMSTRIP_TILES_PER_SHEET = 100
+
+
+class FilmstripWriter:
+    """Collects a low resolution thumbnail every interval seconds from frames decoded elsewhere.
+
+    With subtitle_windows ((start, end) per sentence), every tile is labelled with its sentence and
+    one more is taken at the middle of each window, so short sentences between tiles get one too.
+    Writes <prefix>_NNN.jpg sprite sheets and a <prefix>.json index of tile times and positions.
+    """
+
+    def __init__(self, prefix, fps: float, frame_width: int, frame_height: int,
+                 interval: float = FILMSTRIP_INTERVAL_SECONDS, tile_height: int = FILMSTRIP_TILE_HEIGHT,
+                 subtitle_windows: Optional[List[Tuple[float, float]]] = None):
+        self.prefix = Path(prefix)
+        self.fps = fps
+        self.interval = interval
+        self.tile_height = tile_height
+        self.tile_width = max(2, int(round(frame_width * tile_height / frame_height / 2)) * 2)
+        self.subtitle_windows = subtitle_windows or []
+        self.next_tile_time = 0.0
+        self.next_sentence = 0
+        self.tiles: List[Dict] = []
+        self.sheet_tiles: List[np.ndarray] = []
+        self.sheets: List[str] = []
+
+    def offer(self, frame_number: int, frame: np.ndarray):
+        """Keep a thumbnail of the (BGR) frame if it is the first one at or after the next tile or sentence time."""
+        import cv2
+
+        time = frame_number / self.fps
+        sentences = []
+        while (self.next_sentence < len(self.subtitle_windows)
+               and time >= sum(self.subtitle_windows[self.next_sentence]) / 2):
+            sentences.append(self.next_sentence)
+            self.next_sentence += 1
+        if time >= self.next_tile_time:
+            self.next_tile_time = (int(time / self.interval) + 1) * self.interval
+            if not sentences:
+                sentences.append(srt_index_at(self.subtitle_windows, time))
+        if not sentences:
+            return
+
+        index = len(self.sheet_tiles)
+        self.sheet_tiles.append(cv2.resize(frame, (self.tile_width, self.tile_height), interpolation=cv2.INTER_AREA))
+        # Sentences shorter than a frame share the thumbnail
+        for srt_index in sentences:
+            self.tiles.append({
+                'time': time,
+                'sheet': len(self.sheets),
+                'x': (index % FILMSTRIP_COLUMNS) * self.tile_width,
+                'y': (index // FILMSTRIP_COLUMNS) * self.tile_height,
+                'srt_index': srt_index,
+            })
+        if len(self.sheet_tiles) == FILMSTRIP_TILES_PER_SHEET:
+            self.write_sheet()
+
+    def write_sheet(self):
+        import cv2
+        import numpy as np
+
+        rows = -(-len(self.sheet_tiles) // FILMSTRIP_COLUMNS)
+        columns = min(len(self.sheet_tiles), FILMSTRIP_COLUMNS)
+        sheet = np.zeros((rows * self.tile_height, columns * self.tile_width, 3), dtype=np.uint8)
+        for index, tile in enumerate(self.sheet_tiles):
+            y = (index // FILMSTRIP_COLUMNS) * self.tile_height
+            x = (index % FILMSTRIP_COLUMNS) * self.tile_width
+            sheet[y:y + self.tile_height, x:x + self.tile_width] = tile
+        name = f"{self.prefix.name}_{len(self.sheets):03d}.jpg"
+        tmp_path = self.prefix.with_name(f".{name}.tmp.jpg")
+        cv2.imwrite(str(tmp_path), sheet, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        os.replace(tmp_path, self.prefix.with_name(name))
+        self.sheets.append(name)
+        self.sheet_tiles = []
+
+    def close(self) -> Path:
+        if self.sheet_tiles:
+            self.write_sheet()
+        index = {
+            'interval': self.interval,
+            'tile_width': self.tile_width,
+            'tile_height': self.tile_height,
+            'columns': FILMSTRIP_COLUMNS,
+            'sheets': self.sheets,
+            'tiles': self.tiles,
+        }
+        index_path = save_filmstrip_index(self.prefix.with_suffix('.json'), index)
+        logging.info(f"Wrote filmstrip of {len(self.tiles)} tiles in {len(self.sheets)} sheets to {index_path}")
+        return index_path
+
+
+def save_filmstrip_index(index_path: Path, index: Dict) -> Path:
+    tmp_path = index_path.with_name(f".{index_path.name}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def srt_index_at(subtitle_windows: List[Tuple[float, float]], time: float) -> Optional[int]:
+    """Index of the subtitle (start, end) window time falls in, or None between sentences."""
+    return next((i for i, (start, end) in enumerate(subtitle_windows) if start <= time <= end), None)
+
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from cache import file_hash
+
+FONT_ROOT = Path(os.environ.get('FONT_DIR', 'fonts'))
+FONT_FACE_CACHE_SIZE = int(os.environ.get('FONT_FACE_CACHE_SIZE', 32))
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+SYSTEM_FONT_DIRS = [
+    '/usr/share/fonts',
+    '/usr/local/share/fonts',
+    os.path.expanduser('~/.fonts'),
+    os.path.expanduser('~/.local/share/fonts'),
+]
+
+# (font path, size) -> FreeTypeFont, least recently used first
+_faces: "OrderedDict[Tuple[str, int], Any]" = OrderedDict()
+_faces_lock = threading.Lock()
+_font_list: Dict[str, str] = {}
+
+
+def validate_font(path) -> Tuple[str, str]:
+    """Parse the font once and return its (family, style); raises ValueError for anything FreeType rejects."""
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.truetype(str(path), 12).getname()
+    except OSError as e:
+        raise ValueError(f"{Path(path).name} is not a usable font: {e}")
+
+
+def register_font(path, move: bool = False) -> Path:
+    """Store a font under fonts/<sha256><ext> and return that path; identical fonts are kept once."""
+    path = Path(path)
+    extension = path.suffix.lower() if path.suffix.lower() in FONT_EXTENSIONS else '.ttf'
+    registered = FONT_ROOT / f"{file_hash(path)}{extension}"
+    if registered.exists():
+        logging.info(f"Font {path.name} is already registered as {registered}")
+        return registered
+
+    family, style = validate_font(path)
+    FONT_ROOT.mkdir(parents=True, exist_ok=True)
+    if move:
+        os.replace(path, registered)
+    else:
+        tmp_path = FONT_ROOT / f".{uuid.uuid4().hex}.tmp"
+        with open(path, 'rb') as source, open(tmp_path, 'wb') as target:
+            target.write(source.read())
+        os.replace(tmp_path, registered)
+    logging.info(f"Registered font {family} {style} from {path.name} as {registered}")
+    return registered
+
+
+def register_font_upload(upload) -> Path:
+    """Register an uploaded font (a werkzeug FileStorage) without keeping a per-request copy."""
+    FONT_ROOT.mkdir(parents=True, exist_ok=True)
+    upload_path = FONT_ROOT / f".{uuid.uuid4().hex}{Path(upload.filename).suffix.lower()}"
+    upload.save(str(upload_path))
+    try:
+        return register_font(upload_path, move=True)
+    finally:
+        upload_path.unlink(missing_ok=True)
+
+
+def resolve_font_file(font) -> Optional[str]:
+    """Font file for a path or an ImageMagick-style font name (see list_fonts), None if it is neither."""
+    if os.path.isfile(font):
+        return str(font)
+    return list_fonts().get(str(font))
+
+
+def get_font_face(font_path, size: int):
+    """Return the parsed face for a font size, shared by every job in the process."""
+    from PIL import ImageFont
+
+    key = (str(Path(font_path).resolve()), int(size))
+    with _faces_lock:
+        if key in _faces:
+            _faces.move_to_end(key)
+            return _faces[key]
+    # Plain FreeType layout (kerning, no shaping or ligatures) like ImageMagick's text rendering
+    face = ImageFont.truetype(key[0], key[1], layout_engine=ImageFont.Layout.BASIC)
+    with _faces_lock:
+        _faces[key] = face
+        while len(_faces) > FONT_FACE_CACHE_SIZE:
+            _faces.popitem(last=False)
+    return face
+
+
+def measure_text(font_path, size: int, text: str) -> int:
+    """Width in pixels of a single line with kerning, rounded like the width of an ImageMagick label."""
+    return int(get_font_face(font_path, size).getlength(text) + 0.5)
+
+
+def font_name(family: str, style: str) -> str:
+    # Same naming as ImageMagick's font list, e.g. DejaVu-Sans-Bold
+    parts = [family] if style in ('Regular', 'Book', 'Normal') else [family, style]
+    return '-'.join(parts).replace(' ', '-')
+
+
+def list_fonts(refresh: bool = False) -> Dict[str, str]:
+    """Map font names to files for system and registered fonts, parsed in-process and listed once."""
+    if _font_list and not refresh:
+        return dict(_font_list)
+
+    from PIL import ImageFont
+
+    fonts = {}
+    for directory in SYSTEM_FONT_DIRS + [str(FONT_ROOT)]:
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                if not name.lower().endswith(FONT_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    family, style = ImageFont.truetype(path, 12).getname()
+                except OSError:
+                    continue
+                fonts.setdefault(font_name(family, style), path)
+    _font_list.clear()
+    _font_list.update(sorted(fonts.items()))
+    return dict(_font_list)
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import logging
+import os
+import subprocess
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from ffmpeg_backend import (
+    AUDIO_ENCODER_ARGS, FFMPEG_BINARY, VIDEO_ENCODER_ARGS, fan_out_filters, segment_filter_chain, segment_input_args
+)
+from test import cached_subtitle_overlay, subtitle_overlay_position
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Trace allocations per frame with tracemalloc, it slows rendering down so it is off by default
+FRAME_ALLOC_TRACE = os.environ.get('FRAME_ALLOC_TRACE', '0') == '1'
+# Frames allowed to allocate (buffers, first overlay preparation) before steady state is measured
+FRAME_ALLOC_WARMUP = int(os.environ.get('FRAME_ALLOC_WARMUP', 30))
+
+
+def kill_process(proc: subprocess.Popen):
+    proc.kill()
+    proc.wait()
+    for pipe in (proc.stdin, proc.stdout, proc.stderr):
+        if pipe is not None:
+            pipe.close()
+
+
+class FrameReader:
+    """Decodes one plan segment to rgb24 frames of the output size, read straight into a caller's buffer."""
+
+    def __init__(self, segment: Dict, width: int, height: int, fps: float):
+        command = [
+            FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', *segment_input_args(segment),
+            '-vf', ','.join(segment_filter_chain(segment, width, height, fps)),
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'
+        ]
+        logging.debug(f"Running command: {' '.join(command)}")
+        # Unbuffered, so readinto goes from the pipe into the frame without an intermediate copy
+        self.proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+
+    def read_into(self, view: memoryview) -> bool:
+        """Fill the byte view with the next frame, False once the segment has no more full frames."""
+        filled = 0
+        while filled < len(view):
+            count = self.proc.stdout.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+        return True
+
+    def close(self):
+        self.proc.stdout.close()
+        stderr = self.proc.stderr.read()
+        self.proc.stderr.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg decode failed: {stderr.decode('utf-8')}")
+
+    def kill(self):
+        """Stop the decoder after an error, without draining its pipes."""
+        kill_process(self.proc)
+
+
+class FrameWriter:
+    """Encodes rgb24 frames written as memoryviews, with the plan's audio muxed in by the same ffmpeg."""
+
+    def __init__(self, plan: Dict, output_path, video_args: List[str], audio_args: List[str],
+                 output_filters: Optional[List[str]] = None,
+                 extra_outputs: Optional[List[Tuple[Any, List[str]]]] = None):
+        total = sum(segment['duration'] for segment in plan['segments'])
+        command = [
+            FFMPEG_BINARY, '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{plan['width']}x{plan['height']}",
+            '-r', str(plan['fps']), '-i', '-'
+        ]
+        if plan['has_audio']:
+            command += ['-ss', f"{plan.get('audio_start', 0.0):.6f}", '-t', f"{total:.6f}", '-i', plan['video']]
+        outputs = [(output_path, output_filters)] + list(extra_outputs or [])
+        filters, output_labels = fan_out_filters('[0:v]', [chain for _, chain in outputs])
+        if filters:
+            command += ['-filter_complex', ';'.join(filters)]
+        for (path, _), label in zip(outputs, output_labels):
+            command += ['-map', '0:v' if label == '[0:v]' else label]
+            if plan['has_audio']:
+                command += ['-map', '1:a:0'] + audio_args
+            command += video_args + [str(path)]
+        logging.debug(f"Running command: {' '.join(command)}")
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+
+    def write(self, view: memoryview):
+        written = 0
+        while written < len(view):
+            written += self.proc.stdin.write(view[written:])
+
+    def close(self):
+        self.proc.stdin.close()
+        stderr = self.proc.stderr.read()
+        self.proc.stderr.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg encode failed: {stderr.decode('utf-8')}")
+
+    def kill(self):
+        """Stop the encoder after an error, leaving a partial output behind."""
+        kill_process(self.proc)
+
+
+class PreparedOverlay:
+    """A subtitle overlay converted once into the float planes an in-place blend needs."""
+
+    def __init__(self, overlay: np.ndarray, x: int, y: int, frame_width: int, frame_height: int):
+        import numpy as np
+
+        # Clip to the frame so the blend region is always a plain slice
+        left, top = max(x, 0), max(y, 0)
+        right = min(x + overlay.shape[1], frame_width)
+        bottom = min(y + overlay.shape[0], frame_height)
+        overlay = overlay[top - y:bottom - y, left - x:right - x]
+        self.rows = slice(top, bottom)
+        self.columns = slice(left, right)
+
+        alpha = overlay[..., 3:4].astype(np.float32) / 255
+        self.inverse_alpha = 1 - alpha
+        # The +0.5 rounds when the result is cast back to uint8
+        self.premultiplied = overlay[..., :3].astype(np.float32) * alpha + 0.5
+        self.scratch = np.empty(self.premultiplied.shape, dtype=np.float32)
+
+    def blend_into(self, frame: np.ndarray):
+        import numpy as np
+
+        region = frame[self.rows, self.columns]
+        np.multiply(region, self.inverse_alpha, out=self.scratch)
+        np.add(self.scratch, self.premultiplied, out=self.scratch)
+        np.copyto(region, self.scratch, casting='unsafe')
+
+
+class AllocationMeter:
+    """Peak bytes allocated per frame as seen by tracemalloc, averaged over the frames after warm-up."""
+
+    def __init__(self, enabled: bool = FRAME_ALLOC_TRACE, warmup: int = FRAME_ALLOC_WARMUP):
+        self.enabled = enabled
+        self.warmup = warmup
+        self.frames = 0
+        self.measured = 0
+        self.total_bytes = 0
+        self.max_bytes = 0
+        self.baseline = 0
+        self.started_tracing = False
+
+    def __enter__(self):
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.started_tracing:
+            tracemalloc.stop()
+
+    def frame_start(self):
+        if self.enabled:
+            tracemalloc.reset_peak()
+            self.baseline = tracemalloc.get_traced_memory()[0]
+
+    def frame_end(self):
+        self.frames += 1
+        if not self.enabled or self.frames <= self.warmup:
+            return
+        allocated = tracemalloc.get_traced_memory()[1] - self.baseline
+        self.measured += 1
+        self.total_bytes += allocated
+        self.max_bytes = max(self.max_bytes, allocated)
+
+    def as_dict(self) -> Dict:
+        return {
+            'frames': self.frames,
+            'measured_frames': self.measured,
+            'mean_bytes_per_frame': self.total_bytes / self.measured if self.measured else None,
+            'max_bytes_per_frame': self.max_bytes if self.measured else None,
+        }
+
+
+def render_plan_zero_copy(
+    plan: Dict,
+    output_path,
+    video_args: List[str] = VIDEO_ENCODER_ARGS,
+    audio_args: List[str] = AUDIO_ENCODER_ARGS,
+    output_filters: Optional[List[str]] = None,
+    measure_allocations: bool = FRAME_ALLOC_TRACE,
+    extra_outputs: Optional[List[Tuple[Any, List[str]]]] = None,
+) -> Path:
+    """Render the plan by piping raw frames through one reused buffer.
+
+    Each segment is decoded (cropped, scaled and looped by ffmpeg) into the buffer with readinto,
+    subtitles are blended into it in place and the same memory is written to the encoder.
+    """
+    import numpy as np
+
+    width, height, fps = plan['width'], plan['height'], plan['fps']
+    style = plan['style']
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    view = memoryview(frame).cast('B')
+    overlays = {}
+
+    start = time.perf_counter()
+    writer = FrameWriter(plan, output_path, video_args, audio_args, output_filters, extra_outputs)
+    with AllocationMeter(measure_allocations) as meter:
+        reader = None
+        try:
+            for segment in plan['segments']:
+                prepared = None
+                subtitle_frames = 0
+                if segment['subtitle'] is not None:
+                    text = segment['subtitle']['text']
+                    if text not in overlays:
+                        overlay, _ = cached_subtitle_overlay(
+                            text, width, style['font_path'], style['font_size'],
+                            style['font_color'], style['bg_color'], style['margin']
+                        )
+                        x, y = subtitle_overlay_position(overlay, width, height, style['margin'])
+                        overlays[text] = PreparedOverlay(overlay, x, y, width, height)
+                    prepared = overlays[text]
+                    subtitle_frames = min(segment['subtitle']['duration'], segment['duration']) * fps
+
+                reader = FrameReader(segment, width, height, fps)
+                index = 0
+                while True:
+                    meter.frame_start()
+                    if not reader.read_into(view):
+                        break
+                    if prepared is not None and index < subtitle_frames:
+                        prepared.blend_into(frame)
+                    writer.write(view)
+                    meter.frame_end()
+                    index += 1
+                reader.close()
+                reader = None
+        except BaseException:
+            # Do not leave ffmpeg processes behind blocked on full pipes
+            if reader is not None:
+                reader.kill()
+            writer.kill()
+            raise
+        writer.close()
+
+    seconds = time.perf_counter() - start
+    message = f"Generated output video: {output_path} ({meter.frames} frames in {seconds:.1f}s"
+    if measure_allocations:
+        allocations = meter.as_dict()
+        message += (f", {allocations['mean_bytes_per_frame'] or 0:.0f} B/frame allocated on average after "
+                    f"{meter.warmup} warm-up frames, {allocations['max_bytes_per_frame'] or 0} B at most")
+    logging.info(message + ")")
+    return Path(output_path)
@@ -0,0 +1,169 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+JANITOR_TTL_SECONDS = float(os.environ.get('JANITOR_TTL_SECONDS', 24 * 3600))
+JANITOR_QUOTA_BYTES = int(os.environ.get('JANITOR_QUOTA_BYTES', 20 * 1024 ** 3))
+JANITOR_INTERVAL_SECONDS = float(os.environ.get('JANITOR_INTERVAL_SECONDS', 300))
+
+
+def path_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def remove_path(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+class Janitor:
+    """Evicts workspace and cache artifacts by TTL and by a global disk quota in a background thread.
+
+    An artifact is an entry `depth` levels below one of the roots, e.g. a tmp/<uuid> workspace
+    (depth 1) or a cache/<namespace>/<key> file (depth 2). Pinned artifacts are never evicted.
+    """
+
+    def __init__(self, roots: Dict[str, int], ttl: float = JANITOR_TTL_SECONDS,
+                 quota_bytes: int = JANITOR_QUOTA_BYTES, interval: float = JANITOR_INTERVAL_SECONDS):
+        self.roots = roots
+        self.ttl = ttl
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self.last_access: Dict[str, float] = {}
+        self.pins = Counter()
+        self.lock = threading.Lock()
+        self.reclaimed_bytes = 0
+        self.evicted_artifacts = 0
+        self.tracked_bytes = 0
+        self.runs = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def touch(self, path):
+        with self.lock:
+            self.last_access[os.path.abspath(path)] = time.time()
+
+    @contextmanager
+    def pinned(self, *paths):
+        """Keep the given artifacts (files or directories) alive while a job uses them."""
+        paths = [os.path.abspath(path) for path in paths if path]
+        with self.lock:
+            for path in paths:
+                self.pins[path] += 1
+                self.last_access[path] = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                for path in paths:
+                    self.pins[path] -= 1
+                    if self.pins[path] <= 0:
+                        del self.pins[path]
+                    self.last_access[path] = time.time()
+
+    def is_pinned(self, path: str) -> bool:
+        # A pinned file inside a workspace pins the workspace, a pinned workspace pins its files
+        return any(
+            pin == path or pin.startswith(path + os.sep) or path.startswith(pin + os.sep)
+            for pin in self.pins
+        )
+
+    def discover(self) -> List[str]:
+        artifacts = []
+        for root, depth in self.roots.items():
+            level = [os.path.abspath(root)]
+            for _ in range(depth):
+                children = []
+                for directory in level:
+                    if os.path.isdir(directory):
+                        children += [os.path.join(directory, name) for name in os.listdir(directory)]
+                level = children
+            artifacts += level
+        return artifacts
+
+    def collect(self) -> int:
+        """Run one eviction pass and return the number of bytes reclaimed."""
+        now = time.time()
+        candidates = []
+        total_bytes = 0
+        for path in self.discover():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            size = path_size(path)
+            total_bytes += size
+            with self.lock:
+                # File times count too, other processes (render workers) mark use with os.utime
+                last_access = max(self.last_access.get(path, 0), stat.st_mtime, stat.st_atime)
+                self.last_access[path] = last_access
+            candidates.append((last_access, path, size))
+
+        reclaimed = 0
+        # Least recently used first
+        for last_access, path, size in sorted(candidates):
+            expired = now - last_access > self.ttl
+            over_quota = total_bytes - reclaimed > self.quota_bytes
+            if not expired and not over_quota:
+                break
+            with self.lock:
+                if self.is_pinned(path):
+                    continue
+                try:
+                    remove_path(path)
+                except OSError as e:
+                    logging.warning(f"Janitor could not remove {path}: {e}")
+                    continue
+                self.last_access.pop(path, None)
+            reclaimed += size
+            self.evicted_artifacts += 1
+            logging.info(f"Janitor evicted {path} ({size} bytes, {'expired' if expired else 'over quota'})")
+
+        with self.lock:
+            self.reclaimed_bytes += reclaimed
+            self.tracked_bytes = total_bytes - reclaimed
+            self.runs += 1
+        return reclaimed
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.collect()
+            except Exception as e:
+                logging.error(f"Janitor run failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='janitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def metrics(self) -> Dict:
+        with self.lock:
+            return {
+                'reclaimed_bytes': self.reclaimed_bytes,
+                'evicted_artifacts': self.evicted_artifacts,
+                'tracked_bytes': self.tracked_bytes,
+                'pinned_artifacts': len(self.pins),
+                'quota_bytes': self.quota_bytes,
+                'ttl_seconds': self.ttl,
+                'runs': self.runs,
+            }
@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+import subprocess
+from bisect import bisect_left
+from typing import Dict, Optional
+
+from cache import file_hash, load_cached_json, save_cached_json
+
+FFPROBE_BINARY = os.environ.get('FFPROBE_BINARY', 'ffprobe')
+
+# Segment cuts within this distance of a keyframe are moved onto it, 0 (the default) disables snapping.
+# A snapped cut no longer falls on the frame where the burned-in subtitle changes.
+KEYFRAME_SNAP_SECONDS = float(os.environ.get('KEYFRAME_SNAP_SECONDS', 0))
+
+
+def build_keyframe_index(video_path) -> Dict:
+    """Scan the packets of the first video stream (no decoding) for keyframe timestamps and byte offsets.
+
+    Timestamps are relative to the container's start_time, like the times -ss and the subtitles use.
+    """
+    command = [
+        FFPROBE_BINARY, '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,dts_time,pos,flags:format=start_time', '-of', 'json', str(video_path)
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {video_path}: {result.stderr.decode('utf-8')}")
+    info = json.loads(result.stdout)
+    start_time = float(info.get('format', {}).get('start_time', 0.0))
+
+    keyframes = []
+    packets = info.get('packets', [])
+    for packet in packets:
+        if 'K' not in packet.get('flags', ''):
+            continue
+        timestamp = packet.get('pts_time', packet.get('dts_time'))
+        if timestamp is None:
+            continue
+        keyframes.append((float(timestamp) - start_time, int(packet.get('pos', -1))))
+
+    # Packets come in decode order, lookups need presentation order
+    keyframes.sort()
+    return {
+        'packets': len(packets),
+        'start_time': start_time,
+        'keyframes': [timestamp for timestamp, _ in keyframes],
+        'positions': [position for _, position in keyframes],
+    }
+
+
+def get_keyframe_index(video_path, key: Optional[str] = None) -> Dict:
+    """Return the keyframe index of a video, built once per content hash (key, when already known)."""
+    key = key or file_hash(video_path)
+    index = load_cached_json('keyframes', key)
+    # Indices without start_time were built from absolute packet timestamps
+    if index is None or 'start_time' not in index:
+        index = build_keyframe_index(video_path)
+        save_cached_json('keyframes', key, index)
+        logging.info(f"Indexed {len(index['keyframes'])} keyframes in {index['packets']} packets of {video_path}")
+    return index
+
+
+def snap_to_keyframe(index: Optional[Dict], t: float, tolerance: float = KEYFRAME_SNAP_SECONDS) -> float:
+    """Move t onto the nearest keyframe when one is within tolerance, so the cut needs no lead-in decoding."""
+    if not index or tolerance <= 0 or not index['keyframes']:
+        return t
+    keyframes = index['keyframes']
+    i = bisect_left(keyframes, t)
+    nearest = min(keyframes[max(i - 1, 0):i + 1], key=lambda keyframe: abs(keyframe - t))
+    return nearest if abs(nearest - t) <= tolerance else t
+
@@ -0,0 +1,255 @@
+import json
+import logging
+import math
+import random
+import subprocess
+import threading
+import time
+import uuid
+from http.cookiejar import CookieJar
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from ffmpeg_backend import FFMPEG_BINARY
+
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+SENTENCES = [
+    "The quick brown fox jumps over the lazy dog.",
+    "A synthetic sentence keeps the aligner busy.",
+    "Every editor clicks somewhere in the timeline.",
+    "Replacement scenes are uploaded one at a time.",
+    "The final render is downloaded at the end.",
+    "Load tests should look like real sessions.",
+]
+
+
+def run_ffmpeg(args: List[str]):
+    command = [FFMPEG_BINARY, '-y', '-hide_banner', '-loglevel', 'error'] + args
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode('utf-8')}")
+
+
+def generate_media(work_dir: Path, duration: float, size: str = '640x360', fps: int = 25) -> Dict[str, Path]:
+    """Create a test video with audio, the matching MP3 and transcript, and a replacement scene with ffmpeg's lavfi sources."""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    media = {
+        'video': work_dir / 'video.mp4',
+        'mp3': work_dir / 'audio.mp3',
+        'text': work_dir / 'script.txt',
+        'scene': work_dir / 'scene.mp4',
+    }
+    run_ffmpeg(['-f', 'lavfi', '-i', f"testsrc2=size={size}:rate={fps}:duration={duration}",
+                '-f', 'lavfi', '-i', f"sine=frequency=440:duration={duration}",
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest',
+                str(media['video'])])
+    run_ffmpeg(['-i', str(media['video']), '-vn', '-c:a', 'libmp3lame', str(media['mp3'])])
+    run_ffmpeg(['-f', 'lavfi', '-i', f"smptebars=size={size}:rate={fps}:duration=3",
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', str(media['scene'])])
+    media['text'].write_text('\n'.join(SENTENCES) + '\n')
+    return media
+
+
+def encode_multipart(fields: Dict[str, str], files: Dict[str, Path]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    for name, path in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{path.name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8')
+        )
+        parts.append(path.read_bytes())
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class VirtualUser:
+    """One editor session with its own cookie jar, walking through the web.py workflow."""
+
+    def __init__(self, user_id: int, base_url: str, media: Dict[str, Path], font: Path, results: List[Dict],
+                 media_seconds: float, think_min: float, think_max: float, clicks: int, timeout: float):
+        self.user_id = user_id
+        self.base_url = base_url.rstrip('/')
+        self.media = media
+        self.media_seconds = media_seconds
+        self.font = font
+        self.results = results
+        self.think_min = think_min
+        self.think_max = think_max
+        self.clicks = clicks
+        self.timeout = timeout
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+
+    def think(self):
+        time.sleep(random.uniform(self.think_min, self.think_max))
+
+    def request(self, endpoint: str, path: str, data: bytes = None, content_type: str = None) -> Optional[bytes]:
+        request = Request(self.base_url + path, data=data)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        start = time.perf_counter()
+        status, body = None, None
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                body = response.read()
+                status = response.status
+        except HTTPError as e:
+            status = e.code
+        except (URLError, OSError) as e:
+            logging.debug(f"User {self.user_id} {endpoint} failed: {e}")
+        self.results.append({
+            'user': self.user_id,
+            'endpoint': endpoint,
+            'status': status,
+            'ok': status is not None and status < 400,
+            'seconds': time.perf_counter() - start,
+            'finished': time.time(),
+        })
+        return body if status is not None and status < 400 else None
+
+    def run_session(self) -> bool:
+        body, content_type = encode_multipart(
+            {'font_size': '36', 'font_color': '#fffff2', 'bg_color': '#000000', 'margin': '26'},
+            {'video_file': self.media['video'], 'mp3_file': self.media['mp3'],
+             'text_file': self.media['text'], 'font_file': self.font},
+        )
+        # Follows the redirect to /video_processing like the browser does
+        if self.request('/process', '/process', body, content_type) is None:
+            return False
+        self.think()
+
+        srt_index = -1
+        for _ in range(self.clicks):
+            response = self.request('/get_srt_index', f"/get_srt_index?time={random.uniform(0, self.media_seconds):.3f}")
+            if response is not None and json.loads(response)['srt_index'] != -1:
+                srt_index = json.loads(response)['srt_index']
+            self.think()
+        if srt_index == -1:
+            return False
+
+        body, content_type = encode_multipart({'srt_index': str(srt_index)}, {'scene': self.media['scene']})
+        if self.request('/upload_new_scene', '/upload_new_scene', body, content_type) is None:
+            return False
+        body, content_type = encode_multipart({'srt_index': str(srt_index)}, {})
+        self.request('/preview_segment', '/preview_segment', body, content_type)
+        self.think()
+
+        if self.request('/process_video', '/process_video', b'') is None:
+            return False
+        self.think()
+        return self.request('/uploads/<filename>', f"/uploads/original_video.mp4?timestamp={time.time()}") is not None
+
+    def run(self, iterations: int):
+        for _ in range(iterations):
+            ok = self.run_session()
+            self.results.append({'user': self.user_id, 'endpoint': 'session', 'status': None, 'ok': ok,
+                                 'seconds': None, 'finished': time.time()})
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def build_report(results: List[Dict], wall_seconds: float, users: int) -> Dict:
+    endpoints = {}
+    for endpoint in sorted({result['endpoint'] for result in results if result['endpoint'] != 'session'}):
+        rows = [result for result in results if result['endpoint'] == endpoint]
+        latencies = [row['seconds'] for row in rows]
+        errors = sum(not row['ok'] for row in rows)
+        endpoints[endpoint] = {
+            'requests': len(rows),
+            'errors': errors,
+            'error_rate': errors / len(rows),
+            'throughput_per_second': len(rows) / wall_seconds,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+        }
+    sessions = [result for result in results if result['endpoint'] == 'session']
+    return {
+        'users': users,
+        'wall_seconds': wall_seconds,
+        'sessions': len(sessions),
+        'failed_sessions': sum(not session['ok'] for session in sessions),
+        'sessions_per_minute': len(sessions) / wall_seconds * 60,
+        'endpoints': endpoints,
+    }
+
+
+def run_load_test(base_url: str, users: int, iterations: int, ramp_up: float, think_min: float, think_max: float,
+                  clicks: int, work_dir: Path, font: Path, media_seconds: float, timeout: float) -> Dict:
+    host = urlparse(base_url).hostname
+    if host not in LOCAL_HOSTS:
+        raise ValueError(f"Refusing to load test {host}, only {', '.join(LOCAL_HOSTS)} are allowed")
+
+    media = generate_media(work_dir, media_seconds)
+    logging.info(f"Generated synthetic media in {work_dir}")
+    results = []
+    virtual_users = [
+        VirtualUser(user_id, base_url, media, font, results, media_seconds, think_min, think_max, clicks, timeout)
+        for user_id in range(users)
+    ]
+
+    start = time.perf_counter()
+    threads = []
+    for virtual_user in virtual_users:
+        thread = threading.Thread(target=virtual_user.run, args=(iterations,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        time.sleep(ramp_up / max(users, 1))
+    for thread in threads:
+        thread.join()
+    return build_report(results, time.perf_counter() - start, users)
+
+
+def print_report(report: Dict):
+    print(f"{report['users']} users, {report['sessions']} sessions ({report['failed_sessions']} failed) "
+          f"in {report['wall_seconds']:.1f}s, {report['sessions_per_minute']:.2f} sessions/min")
+    print(f"{'endpoint':<22}{'requests':>9}{'error%':>8}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<22}{row['requests']:>9}{row['error_rate']:>8.1%}{row['throughput_per_second']:>8.2f}"
+              f"{row['p50']:>8.2f}s{row['p95']:>8.2f}s{row['p99']:>8.2f}s")
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import tempfile
+
+    from fonts import list_fonts
+    from test import configure_logging
+
+    parser = argparse.ArgumentParser(description="Drive the web editor workflow with concurrent virtual users")
+    parser.add_argument("--base_url", default="http://127.0.0.1:5000", help="Local web.py instance")
+    parser.add_argument("--users", "-u", default=4, type=int, help="Concurrent virtual users")
+    parser.add_argument("--iterations", "-n", default=1, type=int, help="Sessions per user")
+    parser.add_argument("--ramp_up", default=5.0, type=float, help="Seconds over which users start")
+    parser.add_argument("--think_min", default=0.5, type=float, help="Minimum think time between steps")
+    parser.add_argument("--think_max", default=2.0, type=float, help="Maximum think time between steps")
+    parser.add_argument("--clicks", default=3, type=int, help="Timeline clicks (/get_srt_index) per session")
+    parser.add_argument("--media_seconds", default=15.0, type=float, help="Length of the synthetic video")
+    parser.add_argument("--font", default=None, help="TTF to upload, defaults to the first installed font")
+    parser.add_argument("--timeout", default=600.0, type=float, help="Per-request timeout in seconds")
+    parser.add_argument("--work_dir", default=None, help="Where to write the synthetic media")
+    parser.add_argument("--report", default=None, help="Also write the report as JSON to this file")
+
+    args = parser.parse_args()
+    configure_logging()
+    font = args.font or next(iter(list_fonts().values()), None)
+    if font is None:
+        sys.exit("No font found, pass one with --font")
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix='loadtest_'))
+
+    report = run_load_test(args.base_url, args.users, args.iterations, args.ramp_up, args.think_min,
+                           args.think_max, args.clicks, work_dir, Path(font), args.media_seconds, args.timeout)
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
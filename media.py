@@ -0,0 +1,130 @@
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+from flask import Response, abort, request
+from werkzeug.utils import safe_join
+
+CHUNK_SIZE = 1 << 20
+
+# When set (e.g. '/protected_uploads/'), nginx serves the bytes itself with sendfile and Range support
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX')
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Return the (start, end) inclusive byte range asked for, or None to send the whole file."""
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        # Multiple ranges or other units, the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(header)
+    return start, end
+
+
+def is_not_modified(etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def iter_file_range(path: str, start: int, length: int):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_body(path: str, start: int, length: int, size: int):
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    # gunicorn turns the wrapper into os.sendfile from the current offset for Content-Length bytes,
+    # other servers only know to send the file to its end
+    server = request.environ.get('SERVER_SOFTWARE', '')
+    if file_wrapper is not None and (start + length == size or server.startswith('gunicorn')):
+        f = open(path, 'rb')
+        f.seek(start)
+        return file_wrapper(f, CHUNK_SIZE)
+    return iter_file_range(path, start, length)
+
+
+def send_media_file(directory: str, filename: str) -> Response:
+    """Serve a file with Range/206 support and ETag/Last-Modified validation."""
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    stat = os.stat(path)
+    size = stat.st_size
+    # Cheap validator from the stat we already have; outputs are replaced by rename or rewritten, both change it
+    etag = f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        # Rendered outputs are rewritten in place, always revalidate (a 304 is cheap)
+        'Cache-Control': 'no-cache',
+    }
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if is_not_modified(etag, stat.st_mtime):
+        return Response(status=304, headers=headers)
+
+    if MEDIA_ACCEL_PREFIX:
+        headers['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + filename
+        return Response(status=200, headers=headers, mimetype=mimetype)
+
+    start, end, status = 0, size - 1, 200
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and (if_range is None or if_range.strip() in (etag, last_modified)):
+        try:
+            byte_range = parse_range_header(range_header, size)
+        except RangeNotSatisfiable:
+            headers['Content-Range'] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1 if size else 0
+    headers['Content-Length'] = str(length)
+    return Response(
+        file_body(path, start, length, size),
+        status=status,
+        headers=headers,
+        mimetype=mimetype,
+        direct_passthrough=True,
+    )
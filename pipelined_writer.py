@@ -0,0 +1,201 @@
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from ffmpeg_backend import FFMPEG_BINARY
+
+PIPELINE_QUEUE_FRAMES = int(os.environ.get('PIPELINE_QUEUE_FRAMES', 32))
+AUDIO_FPS = 44100
+# The moviepy backend's encoder settings, the same write_videofile(codec="libx264", audio_codec="aac") uses
+VIDEO_CODEC = 'libx264'
+VIDEO_PRESET = 'medium'
+AUDIO_CODEC = 'aac'
+
+_END = object()
+
+
+class PipelineStats:
+    """Where each side of the frame queue spent its time waiting, and how full the queue was."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.frames = 0
+        self.occupancy_total = 0
+        self.producer_blocked = 0.0
+        self.writer_blocked = 0.0
+        self.audio_seconds = 0.0
+        self.mux_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def bottleneck(self) -> str:
+        # A full queue means frames are ready faster than ffmpeg takes them, an empty one the opposite
+        return 'encoding' if self.producer_blocked > self.writer_blocked else 'composition'
+
+    def as_dict(self) -> Dict:
+        return {
+            'frames': self.frames,
+            'queue_capacity': self.capacity,
+            'mean_queue_occupancy': self.occupancy_total / self.frames if self.frames else 0.0,
+            'producer_blocked_seconds': self.producer_blocked,
+            'writer_blocked_seconds': self.writer_blocked,
+            'audio_seconds': self.audio_seconds,
+            'mux_seconds': self.mux_seconds,
+            'total_seconds': self.total_seconds,
+            'bottleneck': self.bottleneck(),
+        }
+
+
+def put_until_stopped(frames: queue.Queue, item, stop: threading.Event) -> float:
+    """Put an item, giving up once the writer has stopped; returns the seconds spent blocked."""
+    start = time.perf_counter()
+    while not stop.is_set():
+        try:
+            frames.put(item, timeout=0.5)
+            break
+        except queue.Full:
+            continue
+    return time.perf_counter() - start
+
+
+def produce_frames(clip, fps: float, frames: queue.Queue, stats: PipelineStats, stop: threading.Event):
+    try:
+        for frame in clip.iter_frames(fps=fps, dtype='uint8'):
+            stats.producer_blocked += put_until_stopped(frames, frame, stop)
+            if stop.is_set():
+                return
+        put_until_stopped(frames, _END, stop)
+    except Exception as e:
+        put_until_stopped(frames, e, stop)
+
+
+def encode_audio(clip, audio_path: str, audio_codec: str, stats: PipelineStats, errors: list):
+    start = time.perf_counter()
+    try:
+        clip.audio.write_audiofile(audio_path, fps=AUDIO_FPS, codec=audio_codec, logger=None)
+    except Exception as e:
+        errors.append(e)
+    stats.audio_seconds = time.perf_counter() - start
+
+
+def mux(video_path: str, audio_path: str, output_path: str):
+    command = [
+        FFMPEG_BINARY, '-y', '-hide_banner', '-loglevel', 'error', '-i', video_path, '-i', audio_path,
+        '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-shortest', output_path
+    ]
+    logging.debug(f"Running command: {' '.join(command)}")
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg mux failed: {result.stderr.decode('utf-8')}")
+
+
+def write_clip_pipelined(
+    clip,
+    output_path,
+    fps: float = None,
+    codec: str = VIDEO_CODEC,
+    preset: str = VIDEO_PRESET,
+    audio: bool = True,
+    audio_codec: str = AUDIO_CODEC,
+    queue_frames: int = PIPELINE_QUEUE_FRAMES,
+    extra_outputs: Optional[List[Tuple[Any, Dict]]] = None,
+) -> Dict:
+    """Drop-in for clip.write_videofile that overlaps frame composition, video encoding and audio encoding.
+
+    A producer thread composes frames into a bounded queue, this thread feeds them to ffmpeg, and the
+    audio track is encoded in parallel and muxed in at the end without re-encoding. Each
+    (path, geometry) in extra_outputs (see renditions.rendition_geometry) gets its own encoder fed
+    with a crop and resize of the same composed frame. Returns the pipeline statistics, which are
+    also logged.
+    """
+    import cv2
+    from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+    output_path = Path(output_path)
+    fps = fps or clip.fps
+    with_audio = audio and clip.audio is not None
+    outputs = [(output_path, None)] + [(Path(path), geometry) for path, geometry in extra_outputs or []]
+    video_paths = [
+        path.with_name(f"{path.stem}.video{path.suffix}") if with_audio else path for path, _ in outputs
+    ]
+    audio_path = output_path.with_name(f"{output_path.stem}.audio.m4a")
+
+    stats = PipelineStats(queue_frames)
+    frames = queue.Queue(maxsize=queue_frames)
+    stop = threading.Event()
+    audio_errors = []
+    start = time.perf_counter()
+
+    producer = threading.Thread(target=produce_frames, args=(clip, fps, frames, stats, stop), daemon=True)
+    audio_thread = None
+    if with_audio:
+        audio_thread = threading.Thread(
+            target=encode_audio, args=(clip, audio_path.as_posix(), audio_codec, stats, audio_errors), daemon=True
+        )
+
+    writers = []
+    try:
+        try:
+            if audio_thread is not None:
+                audio_thread.start()
+            producer.start()
+            writers = [
+                FFMPEG_VideoWriter(video_path.as_posix(), geometry['size'] if geometry else clip.size, fps,
+                                   codec=codec, preset=preset)
+                for video_path, (_, geometry) in zip(video_paths, outputs)
+            ]
+            while True:
+                wait_start = time.perf_counter()
+                frame = frames.get()
+                stats.writer_blocked += time.perf_counter() - wait_start
+                if frame is _END:
+                    break
+                if isinstance(frame, Exception):
+                    raise frame
+                stats.occupancy_total += frames.qsize()
+                for writer, (_, geometry) in zip(writers, outputs):
+                    if geometry is None:
+                        writer.write_frame(frame)
+                        continue
+                    x1, y1, x2, y2 = geometry['crop']
+                    rendition = frame[y1:y2, x1:x2]
+                    if [x2 - x1, y2 - y1] != list(geometry['size']):
+                        rendition = cv2.resize(rendition, tuple(geometry['size']), interpolation=cv2.INTER_AREA)
+                    writer.write_frame(rendition)
+                stats.frames += 1
+        finally:
+            # Also on errors: release the producer, close the encoders and wait for both threads
+            stop.set()
+            for writer in writers:
+                writer.close()
+            if producer.is_alive():
+                producer.join()
+            if audio_thread is not None and audio_thread.is_alive():
+                audio_thread.join()
+
+        if audio_thread is not None:
+            if audio_errors:
+                raise audio_errors[0]
+            mux_start = time.perf_counter()
+            for video_path, (path, _) in zip(video_paths, outputs):
+                mux(video_path.as_posix(), audio_path.as_posix(), path.as_posix())
+            stats.mux_seconds = time.perf_counter() - mux_start
+    finally:
+        if with_audio:
+            for video_path in video_paths:
+                video_path.unlink(missing_ok=True)
+            audio_path.unlink(missing_ok=True)
+
+    stats.total_seconds = time.perf_counter() - start
+    report = stats.as_dict()
+    logging.info(
+        f"Wrote {report['frames']} frames to {', '.join(str(path) for path, _ in outputs)} in {report['total_seconds']:.1f}s: "
+        f"queue {report['mean_queue_occupancy']:.1f}/{queue_frames} full on average, "
+        f"composition waited {report['producer_blocked_seconds']:.1f}s, encoder waited {report['writer_blocked_seconds']:.1f}s, "
+        f"audio took {report['audio_seconds']:.1f}s ({report['bottleneck']} bound)"
+    )
+    return report
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from cache import cache_path, file_hash
+from ffmpeg_backend import AUDIO_ENCODER_ARGS, VIDEO_ENCODER_ARGS
+from keyframes import KEYFRAME_SNAP_SECONDS
+from pipelined_writer import AUDIO_CODEC, AUDIO_FPS, VIDEO_CODEC, VIDEO_PRESET
+from renditions import RENDITIONS
+
+RENDER_CACHE_NAMESPACE = 'renders'
+# Bump when a render code change should invalidate every stored result. Settings that can change
+# without a code change (environment variables, encoder arguments) go into the key instead.
+RENDER_CACHE_VERSION = 1
+
+# key -> Future of the render that is producing it, so identical concurrent jobs run once
+_in_flight: Dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def source_key(video_path, subtitles_path) -> str:
+    """Identity of an uploaded video and its subtitles, to record at upload time for render_cache_key."""
+    return hashlib.sha256(f"{file_hash(video_path)}:{file_hash(subtitles_path)}".encode('utf-8')).hexdigest()
+
+
+def render_cache_key(
+    source: str,
+    replacements: List[Dict],
+    font_path,
+    style: Dict,
+    render_backend: str,
+    renditions: Optional[List[str]] = None,
+    subtitle_roi: Optional[Dict[str, int]] = None,
+) -> str:
+    """Hash of everything that determines a render's output: input contents, style and encoding profile.
+
+    source identifies the video and subtitles the render starts from: source_key() of an upload, or the
+    key of the render that produced them. It is recorded when they are created rather than read from
+    files that renders overwrite in place.
+    """
+    inputs = {
+        'version': RENDER_CACHE_VERSION,
+        'source': source,
+        'replacements': sorted([replacement['srt_index'], file_hash(replacement['scene_path'])] for replacement in replacements),
+        'font': file_hash(font_path),
+        'style': style,
+        'subtitle_roi': subtitle_roi,
+        'keyframe_snap': KEYFRAME_SNAP_SECONDS,
+        # Chunk count is left out, it changes how the work is split but not what is rendered. Chunked
+        # moviepy renders encode with both sets of settings, so the key always has both.
+        'encoding': {
+            'backend': render_backend,
+            'video': VIDEO_ENCODER_ARGS,
+            'audio': AUDIO_ENCODER_ARGS,
+            'moviepy': {'video': [VIDEO_CODEC, VIDEO_PRESET], 'audio': [AUDIO_CODEC, AUDIO_FPS]},
+        },
+        'renditions': [[name, RENDITIONS[name]] for name in renditions or []],
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def render_entry_path(key: str) -> Path:
+    return cache_path(RENDER_CACHE_NAMESPACE, key)
+
+
+def copy_atomic(source: Path, target: Path):
+    # A copy rather than a hard link, uploads are saved over the same paths in place and would change the entry
+    tmp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def is_render_stored(key: str) -> bool:
+    return (render_entry_path(key) / 'outputs.json').exists()
+
+
+def restore_render(key: str, outputs: Dict[str, Path]) -> bool:
+    """Put the stored files of a render at the output paths, False if there is no complete entry."""
+    entry = render_entry_path(key)
+    try:
+        with open(entry / 'outputs.json', 'r') as f:
+            stored = json.load(f)
+        if set(stored) != set(outputs):
+            return False
+        for name, target in outputs.items():
+            copy_atomic(entry / stored[name], Path(target))
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def store_render(key: str, outputs: Dict[str, Path]):
+    entry = render_entry_path(key)
+    tmp_entry = entry.with_name(f".{entry.name}.{uuid.uuid4().hex}.tmp")
+    tmp_entry.mkdir(parents=True)
+    stored = {}
+    for name, path in outputs.items():
+        stored[name] = f"{name}{Path(path).suffix}"
+        copy_atomic(Path(path), tmp_entry / stored[name])
+    with open(tmp_entry / 'outputs.json', 'w') as f:
+        json.dump(stored, f)
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp_entry, entry)
+
+
+def cached_render(key: str, outputs: Dict[str, Path], render: Callable[[], object]) -> str:
+    """Produce the outputs of a render once per key.
+
+    Returns 'hit' when they were restored from the cache, 'joined' when an identical render was
+    already running and this call waited for it, or 'rendered' when render() ran here.
+    """
+    owner = False
+    for attempt in range(2):
+        if restore_render(key, outputs):
+            logging.info(f"Render cache hit for {key}")
+            return 'hit'
+        with _in_flight_lock:
+            future = _in_flight.get(key)
+            # Checked again under the lock, an identical render may have been stored since the miss.
+            # An entry that still cannot be restored on the second pass is rendered again.
+            if future is None and (attempt > 0 or not is_render_stored(key)):
+                future = _in_flight[key] = Future()
+                owner = True
+                break
+        if future is not None:
+            break
+    if not owner:
+        logging.info(f"Joining the identical render {key} that is already running")
+        future.result()
+        restore_render(key, outputs)
+        return 'joined'
+
+    try:
+        render()
+        store_render(key, outputs)
+        future.set_result(True)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+    logging.info(f"Stored render {key}")
+    return 'rendered'
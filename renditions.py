@@ -0,0 +1,86 @@
+import logging
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from ffmpeg_backend import AUDIO_ENCODER_ARGS, FFMPEG_BINARY, VIDEO_ENCODER_ARGS
+from test import aspect_crop_box
+
+# Extra output formats, each a centre crop to aspect_ratio (None keeps the frame) scaled to height (None keeps it)
+RENDITIONS: Dict[str, Dict] = {
+    'feed': {'aspect_ratio': 4 / 5, 'height': None},
+    'story': {'aspect_ratio': 9 / 16, 'height': None},
+    'preview': {'aspect_ratio': None, 'height': 720},
+}
+
+
+def parse_renditions(value: str) -> List[str]:
+    """Parse a comma separated rendition list such as "feed,story,preview"."""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in RENDITIONS]
+    if unknown:
+        raise ValueError(f"Unknown renditions {', '.join(unknown)}, expected some of {', '.join(RENDITIONS)}")
+    return names
+
+
+def rendition_geometry(name: str, width: int, height: int) -> Dict:
+    """Crop box and output size of a rendition of a width x height composite, with even dimensions for yuv420p."""
+    rendition = RENDITIONS[name]
+    x1, y1, x2, y2 = 0, 0, width, height
+    if rendition['aspect_ratio'] is not None:
+        x1, y1, x2, y2 = aspect_crop_box(width, height, rendition['aspect_ratio'])
+    x2 -= (x2 - x1) % 2
+    y2 -= (y2 - y1) % 2
+    crop_width, crop_height = x2 - x1, y2 - y1
+    if rendition['height'] is not None and rendition['height'] < crop_height:
+        size = (int(round(crop_width * rendition['height'] / crop_height / 2)) * 2, rendition['height'])
+    else:
+        size = (crop_width, crop_height)
+    return {'name': name, 'crop': [x1, y1, x2, y2], 'size': list(size)}
+
+
+def geometry_filters(geometry: Dict) -> List[str]:
+    x1, y1, x2, y2 = geometry['crop']
+    width, height = geometry['size']
+    filters = [f"crop={x2 - x1}:{y2 - y1}:{x1}:{y1}"]
+    if (width, height) != (x2 - x1, y2 - y1):
+        filters.append(f"scale={width}:{height}")
+    return filters
+
+
+def rendition_path(output_path, name: str) -> Path:
+    output_path = Path(output_path)
+    return output_path.with_name(f"{output_path.stem}_{name}{output_path.suffix}")
+
+
+def rendition_outputs(output_path, names: List[str], width: int, height: int) -> List[Tuple[Path, Dict]]:
+    """Output path (<stem>_<name><suffix> next to output_path) and geometry of every requested rendition."""
+    return [(rendition_path(output_path, name), rendition_geometry(name, width, height)) for name in names]
+
+
+def render_renditions_from_file(
+    video_path,
+    outputs: List[Tuple[Path, Dict]],
+    video_args: List[str] = VIDEO_ENCODER_ARGS,
+    audio_args: List[str] = AUDIO_ENCODER_ARGS,
+    has_audio: bool = True,
+) -> List[Path]:
+    """Decode an already rendered video once and encode every rendition from it (used after chunked renders)."""
+    labels = ''.join(f"[split{i}]" for i in range(len(outputs)))
+    filters = [f"[0:v]split={len(outputs)}{labels}"]
+    for i, (_, geometry) in enumerate(outputs):
+        filters.append(f"[split{i}]{','.join(geometry_filters(geometry))}[out{i}]")
+
+    command = [FFMPEG_BINARY, '-y', '-hide_banner', '-loglevel', 'error', '-i', str(video_path),
+               '-filter_complex', ';'.join(filters)]
+    for i, (output_path, _) in enumerate(outputs):
+        command += ['-map', f"[out{i}]"]
+        if has_audio:
+            command += ['-map', '0:a:0?'] + audio_args
+        command += video_args + [str(output_path)]
+    logging.debug(f"Running command: {' '.join(command)}")
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg rendition encode failed: {result.stderr.decode('utf-8')}")
+    logging.info(f"Generated renditions: {', '.join(str(output_path) for output_path, _ in outputs)}")
+    return [Path(output_path) for output_path, _ in outputs]
@@ -1,5 +1,5 @@
-from moviepy.editor import TextClip
+from fonts import list_fonts
 
 # List available fonts
-available_fonts = TextClip.list('font')
-print(available_fonts)
\ No newline at end of file
+available_fonts = list(list_fonts())
+print(available_fonts)
@@ -1,26 +1,32 @@
+from __future__ import annotations
+
 import logging
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, TYPE_CHECKING
 import os
 import subprocess
 import json
-import pysrt
 import textwrap
 import shutil
-from moviepy.editor import (
-    AudioFileClip, ColorClip, CompositeVideoClip, concatenate_videoclips,
-    TextClip, VideoFileClip
-)
+import hashlib
+import threading
+from collections import OrderedDict
 from logging import info, error, debug
-from moviepy.video.fx.crop import crop
-from moviepy.video.fx.loop import loop
-import matplotlib.colors as mcolors
-import cv2
-import numpy as np
 import sys
 
-# Initialization
-logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+from colors import NAMED_COLORS
+
+# moviepy, cv2, NumPy and pysrt are imported inside the functions that need them,
+# so importing this module (web.py, the CLI, worker processes) stays cheap.
+if TYPE_CHECKING:
+    import numpy as np
+    import pysrt
+    from moviepy.editor import VideoFileClip
+
+
+def configure_logging():
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=os.environ.get('LOG_LEVEL', 'DEBUG'))
+
 
 # Set the path to the ImageMagick executable
 os.environ['IMAGEMAGICK_BINARY'] = '/usr/bin/convert'
@@ -28,107 +34,316 @@ os.environ['IMAGEMAGICK_BINARY'] = '/usr/bin/convert'
 
 MAE_THRESHOLD: float = 4.2
 GLITCH_IGNORE_THRESHOLD: float = 0.27
+BINARIZE_THRESHOLD: int = 200
+
+# Fallback subtitle band when calibration finds no text
+BLEEDING = 40
+LINE_HEIGHT = 60
+ROI_SAMPLE_COUNT = 36
+ROI_PADDING = 8
+# Subtitles are looked for below this fraction of the frame height
+ROI_SEARCH_FROM = 0.5
+# Gaps (between lines, between words) bridged when growing the band out from its peak
+ROI_MAX_ROW_GAP = 12
+ROI_MAX_COLUMN_GAP = 60
+
+# Most recently used subtitle overlays kept in memory in front of the disk cache
+OVERLAY_MEMORY_ENTRIES = int(os.environ.get('OVERLAY_MEMORY_ENTRIES', 256))
+overlay_memory_cache = OrderedDict()
+overlay_memory_lock = threading.Lock()
+
+
+def default_subtitle_roi(width: int, height: int) -> Dict[str, int]:
+    return {
+        'top': height - BLEEDING - LINE_HEIGHT,
+        'bottom': height - BLEEDING,
+        'left': BLEEDING,
+        'right': width - BLEEDING,
+    }
+
+
+def parse_subtitle_roi(value: str) -> Dict[str, int]:
+    """Parse a 'top,bottom,left,right' pixel box as given on the CLI or the web form."""
+    top, bottom, left, right = (int(part) for part in value.split(','))
+    if min(top, left) < 0 or top >= bottom or left >= right:
+        raise ValueError(f"Invalid subtitle ROI: {value}")
+    return {'top': top, 'bottom': bottom, 'left': left, 'right': right}
+
+
+def validate_subtitle_roi(roi: Dict[str, int], width: int, height: int) -> Dict[str, int]:
+    """Raise ValueError unless the box is non-empty and inside a width x height frame."""
+    if not (0 <= roi['top'] < roi['bottom'] <= height and 0 <= roi['left'] < roi['right'] <= width):
+        raise ValueError(
+            f"Subtitle ROI {roi['top']},{roi['bottom']},{roi['left']},{roi['right']} "
+            f"is empty or outside the {width}x{height} frame"
+        )
+    return roi
+
+
+def band_around_peak(profile: np.ndarray, max_gap: int, fraction: float = 0.1):
+    """(start, end) of the run of entries above fraction of the peak that contains the peak, bridging gaps up to max_gap."""
+    import numpy as np
+
+    peak = int(np.argmax(profile))
+    active = profile >= fraction * profile[peak]
+
+    def edge(step):
+        last, index, gap = peak, peak + step, 0
+        while 0 <= index < len(active) and gap <= max_gap:
+            if active[index]:
+                last, gap = index, 0
+            else:
+                gap += 1
+            index += step
+        return last
+
+    return edge(-1), edge(1) + 1
+
+
+def detect_subtitle_roi(video_path, sample_count: int = ROI_SAMPLE_COUNT, threshold: int = BINARIZE_THRESHOLD) -> Dict[str, int]:
+    import cv2
+    import numpy as np
+
+    cap = cv2.VideoCapture(str(video_path))
+    HEIGHT = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    WIDTH = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    # Count, per pixel, in how many samples it is bright text with a sharp edge
+    text_hits = np.zeros((HEIGHT, WIDTH), dtype=np.uint16)
+    kernel = np.ones((3, 3), dtype=np.uint8)
+    samples = 0
+    for frame_number in np.linspace(0, max(frame_count - 1, 0), sample_count, dtype=int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_number))
+        ret, frame = cap.read()
+        if not ret:
+            continue
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        _, binary = cv2.threshold(gray, threshold, 1, cv2.THRESH_BINARY)
+        edges = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, kernel) > 80
+        text_hits += (binary.astype(bool) & cv2.dilate(edges.astype(np.uint8), kernel).astype(bool))
+        samples += 1
+    cap.release()
+
+    if samples == 0:
+        logging.warning(f"Could not sample frames from {video_path}, using the default subtitle band")
+        return default_subtitle_roi(WIDTH, HEIGHT)
+
+    # Subtitles come and go, static bright content (logos, white backgrounds) does not
+    changing = (text_hits > 0) & (text_hits < samples)
+    search_top = int(HEIGHT * ROI_SEARCH_FROM)
+    row_profile = np.count_nonzero(changing[search_top:], axis=1)
+    if row_profile.max() == 0:
+        logging.warning(f"No subtitle text found in {video_path}, using the default subtitle band")
+        return default_subtitle_roi(WIDTH, HEIGHT)
+
+    # Only the run around the strongest rows, so moving bright content elsewhere does not stretch the band
+    top, bottom = band_around_peak(row_profile, ROI_MAX_ROW_GAP)
+    top, bottom = top + search_top, bottom + search_top
+    left, right = band_around_peak(np.count_nonzero(changing[top:bottom], axis=0), ROI_MAX_COLUMN_GAP)
+    roi = {
+        'top': max(top - ROI_PADDING, 0),
+        'bottom': min(bottom + ROI_PADDING, HEIGHT),
+        'left': max(left - ROI_PADDING, 0),
+        'right': min(right + ROI_PADDING, WIDTH),
+    }
+    logging.info(f"Detected subtitle ROI for {video_path}: {roi}")
+    return roi
+
+
+def get_subtitle_roi(video_path, override: Dict[str, int] = None) -> Dict[str, int]:
+    """Return the subtitle band to scan, calibrated once per (video hash, geometry)."""
+    import cv2
+    from cache import file_hash, load_cached_json, save_cached_json
+
+    cap = cv2.VideoCapture(str(video_path))
+    width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    if override is not None:
+        return validate_subtitle_roi(override, width, height)
+    geometry = f"{width}x{height}"
+    key = f"{file_hash(video_path)}_{geometry}"
+    roi = load_cached_json('roi', key)
+    if roi is None:
+        roi = detect_subtitle_roi(video_path)
+        save_cached_json('roi', key, roi)
+    return roi
+
+
+def iter_frame_differences(video_path, roi: Dict[str, int] = None, progress=None, progress_every: int = 30, band_store=None, filmstrip=None, subtitle_windows=None):
+    """Yield the per-frame subtitle band difference records one at a time while decoding.
+
+    With band_store, the grayscale band of every decoded frame is also written to that
+    memory-mapped file so thresholds can be re-tuned later without decoding again.
+    With filmstrip (a path prefix), thumbnails of the same decoded frames are written as
+    sprite sheets with a JSON index (see filmstrip.FilmstripWriter), labelled with and
+    covering every sentence of subtitle_windows if given.
+    """
+    import cv2
+    import numpy as np
 
-def split_by_computer_vision(video_path: str = 'your_video.mp4'):
     # Initialize video capture
-    cap = cv2.VideoCapture(video_path)
+    cap = cv2.VideoCapture(str(video_path))
 
     # Get video properties
     fps = cap.get(cv2.CAP_PROP_FPS)
     frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    duration = frame_count / fps
 
     # Define the region of interest (ROI) for the subtitle area
-    # Adjust these values based on your video resolution and subtitle area
-    HEIGHT = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    WIDTH = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    BLEEDING = 40
-    LINE_HEIGHT = 60
-
-    roi_top = HEIGHT - BLEEDING - LINE_HEIGHT
-    roi_bottom = HEIGHT - BLEEDING
-    roi_left = BLEEDING
-    roi_right = WIDTH - BLEEDING
+    roi = get_subtitle_roi(video_path, roi)
+    roi_top = roi['top']
+    roi_bottom = roi['bottom']
+    roi_left = roi['left']
+    roi_right = roi['right']
+
+    band_writer = None
+    if band_store is not None:
+        from band_store import BandStoreWriter
+        band_writer = BandStoreWriter(
+            band_store, frame_count, roi_bottom - roi_top, roi_right - roi_left, fps, roi
+        )
+    filmstrip_writer = None
+    if filmstrip is not None:
+        from filmstrip import FilmstripWriter
+        filmstrip_writer = FilmstripWriter(
+            filmstrip, fps, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            subtitle_windows=subtitle_windows
+        )
 
     # Initialize variables
     prev_frame = None
-    timestamps = []
 
     # Process each frame
     frame_number = 0
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Crop the subtitle area
-        subtitle_area = frame[roi_top:roi_bottom, roi_left:roi_right]
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(subtitle_area, cv2.COLOR_BGR2GRAY)
-        
-        # Apply a binary threshold to create a binary image
-        _, binary = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)
-
-        # save the binary image for debugging
-        # cv2.imwrite(f'tmp/binary_{frame_number}.png', binary)
-        
-        # Compare with the previous frame
-        if prev_frame is not None:
-            # Calculate the difference between the current frame and the previous frame
-            diff = cv2.absdiff(prev_frame, binary)
-            
-            # Calculate the percentage of different pixels
-            non_zero_count = np.count_nonzero(diff)
-            total_count = diff.size
-            diff_percentage = (non_zero_count / total_count) * 100
-            timestamp = frame_number / fps
-            timestamps.append({
-                'frame_number': frame_number,
-                'timestamp': timestamp,
-                'confidence': diff_percentage
-            })
-        
-        # Update the previous frame
-        prev_frame = binary
-        frame_number += 1
-
-    # Release the video capture
-    cap.release()
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if filmstrip_writer is not None:
+                filmstrip_writer.offer(frame_number, frame)
+
+            # Crop the subtitle area
+            subtitle_area = frame[roi_top:roi_bottom, roi_left:roi_right]
+
+            # Convert to grayscale
+            gray = cv2.cvtColor(subtitle_area, cv2.COLOR_BGR2GRAY)
+            if band_writer is not None:
+                band_writer.append(gray)
+
+            # Apply a binary threshold to create a binary image
+            _, binary = cv2.threshold(gray, BINARIZE_THRESHOLD, 255, cv2.THRESH_BINARY)
+
+            # save the binary image for debugging
+            # cv2.imwrite(f'tmp/binary_{frame_number}.png', binary)
+
+            # Compare with the previous frame
+            if prev_frame is not None:
+                # Calculate the difference between the current frame and the previous frame
+                diff = cv2.absdiff(prev_frame, binary)
+
+                # Calculate the percentage of different pixels
+                non_zero_count = np.count_nonzero(diff)
+                total_count = diff.size
+                diff_percentage = (non_zero_count / total_count) * 100
+                timestamp = frame_number / fps
+                yield {
+                    'frame_number': frame_number,
+                    'timestamp': timestamp,
+                    'confidence': diff_percentage
+                }
+
+            # Update the previous frame
+            prev_frame = binary
+            frame_number += 1
+            if progress is not None and frame_number % progress_every == 0:
+                progress(frame_number, frame_count)
+    finally:
+        # Release the video capture, also when the consumer stops early
+        cap.release()
+        if band_writer is not None:
+            band_writer.close()
+        if filmstrip_writer is not None:
+            filmstrip_writer.close()
+
+
+def split_by_computer_vision(video_path: str = 'your_video.mp4', roi: Dict[str, int] = None, band_store=None, filmstrip=None):
+    return list(iter_frame_differences(video_path, roi, band_store=band_store, filmstrip=filmstrip))
+
+
+def debounce_change_events(timestamps, threshold: float = None, glitch_threshold: float = None):
+    """Keep frames above MAE_THRESHOLD that are not glitches of the previous accepted change."""
+    threshold = MAE_THRESHOLD if threshold is None else threshold
+    glitch_threshold = GLITCH_IGNORE_THRESHOLD if glitch_threshold is None else glitch_threshold
+    last_event = None
+    for ts in timestamps:
+        if ts['confidence'] > threshold:
+            if last_event is None or (ts["timestamp"] - last_event["timestamp"] > glitch_threshold):
+                last_event = ts
+                yield ts
+
+
+def iter_subtitle_change_events(video_path, roi: Dict[str, int] = None, progress=None, filmstrip=None, subtitle_windows=None):
+    """Stream debounced subtitle change events as they are found.
+
+    Closing the generator (refine_subtitles_based_on_computer_vision does once every subtitle is matched) stops the decode.
+    """
+    differences = iter_frame_differences(video_path, roi, progress, filmstrip=filmstrip, subtitle_windows=subtitle_windows)
+    try:
+        yield from debounce_change_events(differences)
+    finally:
+        differences.close()
+
+
+def log_scan_progress(frame_number: int, frame_count: int):
+    if frame_count > 0:
+        logging.info(f"Scanned {frame_number}/{frame_count} frames ({frame_number / frame_count:.0%})")
 
-    return timestamps
 
 def load_video_from_file(file: Path) -> VideoFileClip:
+    from moviepy.editor import VideoFileClip
+
     if not file.exists():
         raise FileNotFoundError(f"Video file not found: {file}")
     logging.info(f"Loading video file: {file}")
     return VideoFileClip(file.as_posix())
 
 
-def crop_to_aspect_ratio(video: VideoFileClip, desired_aspect_ratio: float) -> VideoFileClip:
-    video_aspect_ratio = video.w / video.h
+def aspect_crop_box(width: int, height: int, desired_aspect_ratio: float) -> (int, int, int, int):
+    video_aspect_ratio = width / height
     if video_aspect_ratio > desired_aspect_ratio:
-        new_width = int(desired_aspect_ratio * video.h)
-        new_height = video.h
-        x1 = (video.w - new_width) // 2
+        new_width = int(desired_aspect_ratio * height)
+        new_height = height
+        x1 = (width - new_width) // 2
         y1 = 0
     else:
-        new_width = video.w
-        new_height = int(video.w / desired_aspect_ratio)
+        new_width = width
+        new_height = int(width / desired_aspect_ratio)
         x1 = 0
-        y1 = (video.h - new_height) // 2
+        y1 = (height - new_height) // 2
     x2 = x1 + new_width
     y2 = y1 + new_height
+    return x1, y1, x2, y2
+
+
+def crop_to_aspect_ratio(video: VideoFileClip, desired_aspect_ratio: float) -> VideoFileClip:
+    from moviepy.video.fx.crop import crop
+
+    x1, y1, x2, y2 = aspect_crop_box(video.w, video.h, desired_aspect_ratio)
     return crop(video, x1=x1, y1=y1, x2=x2, y2=y2)
 
 
 def load_subtitles_from_file(srt_file: Path) -> pysrt.SubRipFile:
+    import pysrt
+
     if not srt_file.exists():
         raise FileNotFoundError(f"SRT File not found: {srt_file}")
     return pysrt.open(srt_file)
 
 
 def adjust_segment_duration(segment: VideoFileClip, duration: float) -> VideoFileClip:
+    from moviepy.video.fx.loop import loop
+
     current_duration = segment.duration
     if current_duration < duration:
         return loop(segment, duration=duration)
@@ -171,98 +386,209 @@ def convert_color(color):
             return tuple(map(int, color.strip('()').split(',')))
         else:
             # Convert named color to RGB tuple
-            rgb = mcolors.to_rgb(color)
-            return tuple(int(c * 255) for c in rgb)
+            if color.lower() not in NAMED_COLORS:
+                raise ValueError(f"Unknown color name: {color}")
+            return convert_color(NAMED_COLORS[color.lower()])
     else:
         raise ValueError("Color format not recognized. Provide a hex string, named color, or RGB tuple as a string.")
 
 
-def add_subtitles_to_clip(
-    clip: VideoFileClip,
-    subtitle: pysrt.SubRipItem,
+def textclip_line_width(line: str, font: str, font_size: int, font_color: str = "white") -> int:
+    """Width of a single line as rendered by ImageMagick through TextClip."""
+    from moviepy.editor import TextClip
+
+    line_clip = TextClip(line, fontsize=font_size, color=font_color, font=font)
+    line_width, _ = line_clip.size
+    line_clip.close()
+    return line_width
+
+
+def rasterize_subtitle_overlay(
+    text: str,
+    frame_width: int,
     font_path: str,
     font_size: int = 36,
     font_color: str = "white",
     bg_color: str = "black",
     margin: int = 26,
-) -> VideoFileClip:
-    logging.info(f"Adding subtitle: {subtitle.text}")
+) -> np.ndarray:
+    """Rasterize a subtitle box (text over a half transparent background) to an RGBA image."""
+    import numpy as np
+    from moviepy.editor import TextClip
+    from fonts import measure_text, resolve_font_file
 
     # Maximum width allowed for the subtitle box
-    max_box_width = clip.w - 2 * margin
-
-    # Create a TextClip to measure the width of text without wrapping
-    measuring_clip = TextClip(
-        subtitle.text,
-        fontsize=font_size,
-        color=font_color,
-        font=font_path,
-        stroke_color=font_color,
-        stroke_width=1
-    )
-    text_width, text_height = measuring_clip.size
-    measuring_clip.close()
-
+    max_box_width = frame_width - 2 * margin
     padding = 6
-    subtitle_duration = subriptime_to_seconds(subtitle.end) - subriptime_to_seconds(subtitle.start)
 
     # Wrap the text manually based on max_box_width
-    def wrap_text(text, max_width):
-        # Create a TextClip with a temporary small width to avoid wrapping
-        temp_clip = TextClip(text, fontsize=font_size, font=font_path, color=font_color)
-        lines = textwrap.wrap(text, width=max_width)
-        return lines
+    wrapped_lines = textwrap.wrap(text, width=max_box_width - padding)
 
-    wrapped_lines = wrap_text(subtitle.text, max_box_width-padding)
-    
-    # Measure each line
+    # Measure each line from the resident font face instead of an ImageMagick call per line,
+    # unless the font is a name FreeType cannot be pointed at
+    font_file = resolve_font_file(font_path)
     max_line_width = 0
     for line in wrapped_lines:
-        line_clip = TextClip(line, fontsize=font_size, color=font_color, font=font_path)
-        line_width, _ = line_clip.size
+        if font_file is not None:
+            line_width = measure_text(font_file, font_size, line)
+        else:
+            line_width = textclip_line_width(line, font_path, font_size, font_color)
         max_line_width = max(max_line_width, line_width)
-        line_clip.close()
 
     # Set the width of the subtitle box
     box_width = min(max_line_width + padding, max_box_width)
 
     # Create the subtitle clip with the exact maximum width
     subtitle_clip = TextClip(
-        subtitle.text,
+        text,
         fontsize=font_size,
         color=font_color,
         font=font_path,
         method="caption",
         align="center",
         size=(box_width, None)
-    ).set_duration(subtitle_duration)
-
-    text_width, text_height = subtitle_clip.size
+    )
+    text_rgb = subtitle_clip.get_frame(0).astype(np.float32)
+    if subtitle_clip.mask is not None:
+        text_alpha = subtitle_clip.mask.get_frame(0).astype(np.float32)
+    else:
+        text_alpha = np.ones(text_rgb.shape[:2], dtype=np.float32)
+    subtitle_clip.close()
+    text_height, text_width = text_rgb.shape[:2]
 
     # Add padding and create the background box
     box_height = text_height + 2 * padding
-
-    # Convert bg_color to RGB tuple if necessary
-    bg_color = convert_color(bg_color)
+    bg_rgb = np.array(convert_color(bg_color), dtype=np.float32)
     bg_opacity = 0.5
 
-    # Create the background box clip
-    box_clip = (
-        ColorClip(size=(box_width, box_height), color=bg_color)
-        .set_opacity(bg_opacity)
-        .set_duration(subtitle_clip.duration)
-    )
+    overlay = np.empty((box_height, box_width, 4), dtype=np.float32)
+    overlay[:, :, :3] = bg_rgb
+    overlay[:, :, 3] = bg_opacity
+
+    # Composite the text over the half transparent box
+    top = (box_height - text_height) // 2
+    left = (box_width - text_width) // 2
+    text_alpha = text_alpha[:, :, None]
+    region = overlay[top:top + text_height, left:left + text_width]
+    out_alpha = text_alpha + region[:, :, 3:] * (1 - text_alpha)
+    region[:, :, :3] = (text_rgb * text_alpha + region[:, :, :3] * region[:, :, 3:] * (1 - text_alpha)) / out_alpha
+    region[:, :, 3:] = out_alpha
+    overlay[:, :, 3] *= 255
+    return np.clip(overlay, 0, 255).astype(np.uint8)
+
+
+def subtitle_overlay_key(text, frame_width, font_path, font_size, font_color, bg_color, margin) -> str:
+    from cache import file_hash
+
+    # Uploaded fonts are identified by content, ImageMagick font names by name
+    font_id = file_hash(font_path) if os.path.isfile(font_path) else str(font_path)
+    payload = json.dumps([text, font_id, font_size, font_color, bg_color, margin, frame_width])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cached_subtitle_overlay(
+    text: str,
+    frame_width: int,
+    font_path: str,
+    font_size: int = 36,
+    font_color: str = "white",
+    bg_color: str = "black",
+    margin: int = 26,
+) -> (np.ndarray, Path):
+    """Return the rasterized subtitle overlay and its PNG in the disk cache, rendering it only on a miss."""
+    import cv2
+    from cache import cache_path
+
+    key = subtitle_overlay_key(text, frame_width, font_path, font_size, font_color, bg_color, margin)
+    png_path = cache_path('overlays', f"{key}.png")
+    with overlay_memory_lock:
+        if key in overlay_memory_cache and png_path.exists():
+            overlay_memory_cache.move_to_end(key)
+            # The PNG may be handed to ffmpeg, keep the janitor from evicting it
+            os.utime(png_path)
+            return overlay_memory_cache[key], png_path
+
+    if png_path.exists():
+        overlay = cv2.cvtColor(cv2.imread(str(png_path), cv2.IMREAD_UNCHANGED), cv2.COLOR_BGRA2RGBA)
+        # Mark it as recently used for the janitor
+        os.utime(png_path)
+    else:
+        overlay = rasterize_subtitle_overlay(text, frame_width, font_path, font_size, font_color, bg_color, margin)
+        tmp_path = png_path.with_name(f"{key}.{os.getpid()}.tmp.png")
+        cv2.imwrite(str(tmp_path), cv2.cvtColor(overlay, cv2.COLOR_RGBA2BGRA))
+        os.replace(tmp_path, png_path)
+
+    with overlay_memory_lock:
+        overlay_memory_cache[key] = overlay
+        while len(overlay_memory_cache) > OVERLAY_MEMORY_ENTRIES:
+            overlay_memory_cache.popitem(last=False)
+    return overlay, png_path
+
+
+def subtitle_overlay_position(overlay: np.ndarray, frame_width: int, frame_height: int, margin: int) -> (int, int):
+    box_height, box_width = overlay.shape[:2]
+    return (frame_width - box_width) // 2, frame_height - box_height - margin
+
+
+def render_subtitle_overlay(
+    text: str,
+    frame_width: int,
+    frame_height: int,
+    font_path: str,
+    font_size: int = 36,
+    font_color: str = "white",
+    bg_color: str = "black",
+    margin: int = 26,
+) -> (np.ndarray, (int, int)):
+    """Return the RGBA subtitle box and its top-left position in the frame."""
+    overlay, _ = cached_subtitle_overlay(text, frame_width, font_path, font_size, font_color, bg_color, margin)
+    return overlay, subtitle_overlay_position(overlay, frame_width, frame_height, margin)
+
+
+def add_subtitle_text_to_clip(
+    clip: VideoFileClip,
+    text: str,
+    duration: float,
+    font_path: str,
+    font_size: int = 36,
+    font_color: str = "white",
+    bg_color: str = "black",
+    margin: int = 26,
+) -> VideoFileClip:
+    from moviepy.editor import CompositeVideoClip, ImageClip
 
-    # Calculate positions
-    box_position = ("center", clip.h - box_height - margin)
-    subtitle_position = ("center", clip.h - box_height - margin + (box_height - text_height) / 2)
+    logging.info(f"Adding subtitle: {text}")
 
-    # Set the positions of the box and the text clip
-    box_clip = box_clip.set_position(box_position)
-    subtitle_clip = subtitle_clip.set_position(subtitle_position)
+    overlay, position = render_subtitle_overlay(
+        text, clip.w, clip.h, font_path, font_size, font_color, bg_color, margin
+    )
+
+    # Create the subtitle box clip from the rendered overlay
+    overlay_mask = ImageClip(overlay[:, :, 3] / 255.0, ismask=True).set_duration(duration)
+    overlay_clip = (
+        ImageClip(overlay[:, :, :3])
+        .set_mask(overlay_mask)
+        .set_duration(duration)
+        .set_position(position)
+    )
 
     # Return composite video clip with the added subtitle and background box
-    return CompositeVideoClip([clip, box_clip, subtitle_clip])
+    return CompositeVideoClip([clip, overlay_clip])
+
+
+def add_subtitles_to_clip(
+    clip: VideoFileClip,
+    subtitle: pysrt.SubRipItem,
+    font_path: str,
+    font_size: int = 36,
+    font_color: str = "white",
+    bg_color: str = "black",
+    margin: int = 26,
+) -> VideoFileClip:
+    subtitle_duration = subriptime_to_seconds(subtitle.end) - subriptime_to_seconds(subtitle.start)
+    return add_subtitle_text_to_clip(
+        clip, subtitle.text, subtitle_duration, font_path, font_size, font_color, bg_color, margin
+    )
 
 
 def replace_video_segments(
@@ -300,6 +626,43 @@ def replace_video_segments(
     return combined_segments
 
 
+def build_clip_from_plan(plan: Dict) -> VideoFileClip:
+    """Assemble the moviepy clip described by a render plan (see ffmpeg_backend.build_render_plan)."""
+    from moviepy.editor import concatenate_videoclips
+    from moviepy.video.fx.crop import crop
+
+    style = plan['style']
+    sources = {}
+    segments = []
+    for segment in plan['segments']:
+        if segment['source'] not in sources:
+            sources[segment['source']] = load_video_from_file(Path(segment['source']))
+        clip = sources[segment['source']].subclip(segment['start'], segment['end']).without_audio()
+        if segment['crop'] is not None:
+            x1, y1, x2, y2 = segment['crop']
+            clip = crop(clip, x1=x1, y1=y1, x2=x2, y2=y2)
+        clip = adjust_segment_duration(clip, segment['duration'])
+        if (clip.w, clip.h) != (plan['width'], plan['height']):
+            clip = clip.resize(newsize=(plan['width'], plan['height']))
+        clip = clip.set_fps(plan['fps'])
+        if segment['subtitle'] is not None:
+            clip = add_subtitle_text_to_clip(
+                clip, segment['subtitle']['text'], min(segment['subtitle']['duration'], segment['duration']),
+                style['font_path'], style['font_size'], style['font_color'], style['bg_color'], style['margin']
+            )
+        segments.append(clip)
+
+    final_clip = concatenate_videoclips(segments)
+    if plan['has_audio']:
+        if plan['video'] not in sources:
+            sources[plan['video']] = load_video_from_file(Path(plan['video']))
+        audio_start = plan.get('audio_start', 0.0)
+        final_clip = final_clip.set_audio(
+            sources[plan['video']].audio.subclip(audio_start, audio_start + final_clip.duration)
+        )
+    return final_clip
+
+
 def generate_srt_from_txt_and_audio(txt_file: Path, audio_file: Path, output_folder: Path) -> Path:
     output_file_path = txt_file.with_name(txt_file.stem + "_aligned.json")
     command = f'{sys.executable} -m aeneas.tools.execute_task "{audio_file}" "{txt_file}" "task_language=eng|is_text_type=plain|os_task_file_format=json" "{output_file_path}"'
@@ -335,21 +698,18 @@ def generate_srt_from_txt_and_audio(txt_file: Path, audio_file: Path, output_fol
 
     return srt_file
 
-def refine_subtitles_based_on_computer_vision(subtitles: pysrt.SubRipFile, timestamps: List[Dict], replacements: List[Dict]) -> pysrt.SubRipFile:
-    candidate_timestamps = []
+def refine_subtitles_based_on_computer_vision(subtitles: pysrt.SubRipFile, timestamps, replacements: List[Dict]) -> pysrt.SubRipFile:
+    import pysrt
+
+    # timestamps are change events that are already debounced (iter_subtitle_change_events or a cached
+    # list of its events), consumed incrementally so a lazy stream stops decoding once every subtitle is matched
     logging.debug(f"Refining {len(subtitles)} subtitles")
-    for ts in timestamps:
-        if ts['confidence'] > MAE_THRESHOLD:
-            if len(candidate_timestamps) == 0 or (ts["timestamp"] - candidate_timestamps[-1]["timestamp"] > GLITCH_IGNORE_THRESHOLD):
-                candidate_timestamps.append(ts)
-                logging.debug(f"Frame: {ts['frame_number']}, Timestamp: {ts['timestamp']}, Confidence: {ts['confidence']}")
-    logging.info(f"Found {len(candidate_timestamps)} candidate timestamps for subtitle changes")
-    if len(candidate_timestamps) != len(subtitles) - 1:
-        logging.warning(f"The number of candidate timestamps does not match the number of subtitles, {len(subtitles)} vs {len(candidate_timestamps)}")
+    candidate_timestamps = iter(timestamps)
 
     clips = [replacement['srt_index'] for replacement in replacements]
 
-    cursor = 0
+    used_candidates = 0
+    candidate = next(candidate_timestamps, None)
     last_subtitle_record = None
     for subtitle in subtitles:
         if last_subtitle_record is not None:
@@ -361,27 +721,36 @@ def refine_subtitles_based_on_computer_vision(subtitles: pysrt.SubRipFile, times
                     seconds=last_subtitle_record.end.seconds,
                     milliseconds=last_subtitle_record.end.milliseconds
                 )
-        while cursor < len(candidate_timestamps):
-            candidate = candidate_timestamps[cursor]
+        while candidate is not None:
+            logging.debug(f"Frame: {candidate['frame_number']}, Timestamp: {candidate['timestamp']}, Confidence: {candidate['confidence']}")
             subtitle_end = subriptime_to_seconds(subtitle.end)
-            candidate['timestamp'] = candidate['timestamp'] + 0.05
-            if candidate['timestamp'] < subtitle_end - 0.25:
-                cursor += 1
-                logging.debug(f"Skipping candidate timestamp {candidate['timestamp']} for subtitle [{subtitle.text}]")
+            # Shift a copy, the event dict is shared with the debouncer and may be compared again for the next subtitle
+            timestamp = candidate['timestamp'] + 0.05
+            if timestamp < subtitle_end - 0.25:
+                logging.debug(f"Skipping candidate timestamp {timestamp} for subtitle [{subtitle.text}]")
+                candidate = next(candidate_timestamps, None)
                 continue
-            if candidate['timestamp'] > subtitle_end + 1.5:
+            if timestamp > subtitle_end + 1.5:
                 logging.debug(f"Not found for subtitle [{subtitle.text}]")
                 break
-            logging.debug(f"Found candidate timestamp {candidate['timestamp']} for subtitle [{subtitle.text}]")
+            logging.debug(f"Found candidate timestamp {timestamp} for subtitle [{subtitle.text}]")
             subtitle.end = pysrt.SubRipTime(
-                hours=int(candidate['timestamp'] // 3600),
-                minutes=int((candidate['timestamp'] % 3600) // 60),
-                seconds=int(candidate['timestamp'] % 60),
-                milliseconds=int((candidate['timestamp'] % 1) * 1000)
+                hours=int(timestamp // 3600),
+                minutes=int((timestamp % 3600) // 60),
+                seconds=int(timestamp % 60),
+                milliseconds=int((timestamp % 1) * 1000)
             )
-            cursor += 1
+            used_candidates += 1
+            candidate = next(candidate_timestamps, None)
             break
         last_subtitle_record = subtitle
+
+    # Stop the scan, no later change can affect the subtitles
+    if hasattr(timestamps, 'close'):
+        timestamps.close()
+    logging.info(f"Matched {used_candidates} candidate timestamps to subtitle changes")
+    if used_candidates != len(subtitles) - 1:
+        logging.warning(f"The number of matched candidate timestamps does not match the number of subtitles, {len(subtitles)} vs {used_candidates}")
     
     logging.debug(f"All Clips: {clips}")
     for i, subtitle in enumerate(subtitles):
@@ -408,27 +777,32 @@ def refine_subtitles_based_on_computer_vision(subtitles: pysrt.SubRipFile, times
 
 
 
-def main(video_clips_path, my_video, mp3_file_of_same_video, txt_file_of_same_video, output_folder, font_path, font_size, font_color, bg_color,margin):
+def main(video_clips_path, my_video, mp3_file_of_same_video, txt_file_of_same_video, output_folder, font_path, font_size, font_color, bg_color,margin, render_backend="moviepy", subtitle_roi=None, srt_file=None, change_events=None, render_chunks=0, renditions=None):
+    from moviepy.editor import concatenate_videoclips
+
     input_video_file = Path(my_video)
     replacement_base_folder = Path(video_clips_path)
 
     output_folder = Path(output_folder)
     output_folder.mkdir(parents=True, exist_ok=True)
 
-    # Generate SRT file from TXT and MP3
-    srt_file = generate_srt_from_txt_and_audio(Path(txt_file_of_same_video), Path(mp3_file_of_same_video), output_folder)
-    logging.info("Generated SRT file from TXT and MP3")
+    # Generate SRT file from TXT and MP3, unless a batch run already aligned it
+    if srt_file is None:
+        srt_file = generate_srt_from_txt_and_audio(Path(txt_file_of_same_video), Path(mp3_file_of_same_video), output_folder)
+        logging.info("Generated SRT file from TXT and MP3")
+    srt_file = Path(srt_file)
 
     video = load_video_from_file(input_video_file)
-    timestamps = split_by_computer_vision(input_video_file)
-    for ts in timestamps:
-        if ts['confidence'] > MAE_THRESHOLD:
-            logging.debug(f"Frame: {ts['frame_number']}, Timestamp: {ts['timestamp']}, Confidence: {ts['confidence']}")
+    if change_events is None:
+        change_events = iter_subtitle_change_events(input_video_file, subtitle_roi, progress=log_scan_progress)
     logging.info("Video loaded successfully")
-    cropped_video = crop_to_aspect_ratio(video, 4 / 5)
-    logging.info("Video cropped to desired aspect ratio")
     subtitles = load_subtitles_from_file(srt_file)
-    refined_subtitles = refine_subtitles_based_on_computer_vision(subtitles, timestamps, replacement_base_folder)
+    # Replacement folders are named after the 1-based subtitle index
+    replacements = [
+        {'srt_index': int(folder.name) - 1}
+        for folder in replacement_base_folder.iterdir() if folder.is_dir() and folder.name.isdigit()
+    ]
+    refined_subtitles = refine_subtitles_based_on_computer_vision(subtitles, change_events, replacements)
     refined_srt_file = srt_file.with_name(srt_file.stem + "_refined.srt")
     # avoid float precision error
     refined_subtitles.save(refined_srt_file, encoding='utf-8')
@@ -436,15 +810,18 @@ def main(video_clips_path, my_video, mp3_file_of_same_video, txt_file_of_same_vi
     video_segments, subtitle_segments = get_segments_using_srt(video, refined_subtitles)
     logging.info("Segmented Input video based on the SRT Subtitles generated for it")
     output_video_segments = []
+    segment_durations = []
     start = 0
     for video_segment, new_subtitle_segment in zip(video_segments, refined_subtitles):
         end = subriptime_to_seconds(new_subtitle_segment.end)
         required_duration = end - start
         new_video_segment = adjust_segment_duration(video_segment, required_duration)
         output_video_segments.append(new_video_segment.without_audio())
+        segment_durations.append(required_duration)
         start = end
 
     replacement_videos_per_combination = []
+    replacement_files_per_combination = []
 
     for folder in replacement_base_folder.iterdir():
         if not folder.is_dir():
@@ -465,9 +842,39 @@ def main(video_clips_path, my_video, mp3_file_of_same_video, txt_file_of_same_vi
             logging.info(f"Replacement video {replacement_video_file} cropped to desired aspect ratio")
             if len(replacement_videos_per_combination) < len(replacement_video_files):
                 replacement_videos_per_combination.append({})
+                replacement_files_per_combination.append({})
             replacement_videos_per_combination[replacement_video_files.index(replacement_video_file)][replace_index] = cropped_replacement_video
+            replacement_files_per_combination[replacement_video_files.index(replacement_video_file)][replace_index] = replacement_video_file
 
+    from renditions import rendition_outputs
+
+    output_files = []
     for i, replacement_videos in enumerate(replacement_videos_per_combination):
+        output_file = output_folder / f"output_variation_{i+1}.mp4"
+        output_files.append(output_file)
+        if render_backend in ("ffmpeg", "zerocopy") or render_chunks > 1:
+            from ffmpeg_backend import build_render_plan, render_plan_with_ffmpeg
+            from renditions import geometry_filters, render_renditions_from_file
+            plan = build_render_plan(
+                input_video_file, refined_subtitles, replacement_files_per_combination[i], font_path, font_size,
+                font_color, bg_color, margin, segment_durations=segment_durations, aspect_ratio=4 / 5
+            )
+            # Renditions are extra outputs of the same composite, not extra renders
+            extra_outputs = rendition_outputs(output_file, renditions or [], plan['width'], plan['height'])
+            output_files += [path for path, _ in extra_outputs]
+            filter_outputs = [(path, geometry_filters(geometry)) for path, geometry in extra_outputs]
+            if render_chunks > 1:
+                from chunked_render import render_plan_chunked
+                render_plan_chunked(plan, output_file, render_chunks, backend=render_backend)
+                if extra_outputs:
+                    render_renditions_from_file(output_file, extra_outputs, has_audio=plan['has_audio'])
+            elif render_backend == "zerocopy":
+                from frame_io import render_plan_zero_copy
+                render_plan_zero_copy(plan, output_file, extra_outputs=filter_outputs)
+            else:
+                render_plan_with_ffmpeg(plan, output_file, extra_outputs=filter_outputs)
+            continue
+
         final_video_segments = replace_video_segments(
             output_video_segments, replacement_videos, subtitles, video , font_path, font_size,font_color, bg_color,margin
         )
@@ -476,28 +883,55 @@ def main(video_clips_path, my_video, mp3_file_of_same_video, txt_file_of_same_vi
         original_audio = video.audio.subclip(0, concatenated_video.duration)
         final_video_with_audio = concatenated_video.set_audio(original_audio)
         #tmp_path = Path('tmp')
-        output_file = output_folder / f"output_variation_{i+1}.mp4"
-        final_video_with_audio.write_videofile(output_file.as_posix(), codec="libx264", audio_codec="aac")
+        from pipelined_writer import write_clip_pipelined
+        extra_outputs = rendition_outputs(output_file, renditions or [], final_video_with_audio.w, final_video_with_audio.h)
+        output_files += [path for path, _ in extra_outputs]
+        write_clip_pipelined(final_video_with_audio, output_file, codec="libx264", audio_codec="aac", extra_outputs=extra_outputs)
         #shutil.move(tmp_path, output_file)
         logging.info(f"Generated output video: {output_file}")
+    return output_files
 
 
 if __name__ == "__main__":
     import argparse
     from pathlib import Path
+    from renditions import parse_renditions
 
     parser = argparse.ArgumentParser(description="Process video files")
-    parser.add_argument("--input_clips", "-ic", required=True, help="Input clips directory")
-    parser.add_argument("--input_video", "-iv", required=True, help="Input video file")
-    parser.add_argument("--input_mp3", "-im", required=True, help="Input mp3 file")
-    parser.add_argument("--input_txt", "-it", required=True, help="Input txt file")
-    parser.add_argument("--output_dir", "-o", required=True, help="Output directory")
+    parser.add_argument("--input_clips", "-ic", help="Input clips directory")
+    parser.add_argument("--input_video", "-iv", help="Input video file")
+    parser.add_argument("--input_mp3", "-im", help="Input mp3 file")
+    parser.add_argument("--input_txt", "-it", help="Input txt file")
+    parser.add_argument("--output_dir", "-o", help="Output directory")
     parser.add_argument("--font_file", "-fn", default="Montserrat-SemiBold.ttf", help="Font path for subtitles")
     parser.add_argument("--font_size", "-fs", default=33, type=int, help="Font size for subtitles")
     parser.add_argument("--font_color", "-fc", default="white", help="Font color for subtitles")
     parser.add_argument("--bg_color", "-bc", default="black", help="Background color for subtitles")
     parser.add_argument("--margin", "-m", default=20, type=int, help="Margin for subtitles")
+    parser.add_argument("--render_backend", "-rb", default="moviepy", choices=["moviepy", "ffmpeg", "zerocopy"], help="Render backend for the output videos")
+    parser.add_argument("--subtitle_roi", "-roi", default=None, type=parse_subtitle_roi, help="Subtitle band to scan as top,bottom,left,right pixels (detected automatically if omitted)")
+    parser.add_argument("--renditions", "-rn", default=None, type=parse_renditions, help="Extra formats encoded in the same pass, e.g. feed,story,preview")
+    parser.add_argument("--render_chunks", "-rc", default=0, type=int, help="Split each output into this many chunks rendered in parallel processes")
+    parser.add_argument("--batch", "-b", default=None, help="JSON or CSV manifest of projects to process in batch")
+    parser.add_argument("--state_file", default=None, help="Batch state file used to resume after a crash (default: next to the manifest)")
+    parser.add_argument("--align_workers", default=os.cpu_count(), type=int, help="Concurrent aeneas alignments in batch mode")
+    parser.add_argument("--scan_workers", default=max(1, os.cpu_count() // 2), type=int, help="Concurrent computer vision scans in batch mode")
+    parser.add_argument("--render_workers", default=1, type=int, help="Concurrent renders in batch mode (x264 already uses every core)")
+    parser.add_argument("--retries", default=2, type=int, help="Retries per stage in batch mode")
     
     args = parser.parse_args()
-    main(args.input_clips, args.input_video, args.input_mp3, args.input_txt, Path(args.output_dir),args.font_file, args.font_size, args.font_color, args.bg_color, args.margin)
+    configure_logging()
+    if args.batch is not None:
+        from batch import run_batch
+        defaults = {
+            'font_file': args.font_file, 'font_size': args.font_size, 'font_color': args.font_color,
+            'bg_color': args.bg_color, 'margin': args.margin, 'render_backend': args.render_backend,
+            'render_chunks': args.render_chunks, 'renditions': ','.join(args.renditions or []),
+        }
+        run_batch(Path(args.batch), args.state_file, defaults, args.align_workers, args.scan_workers, args.render_workers, args.retries)
+        sys.exit(0)
+    missing = [name for name in ("input_clips", "input_video", "input_mp3", "input_txt", "output_dir") if getattr(args, name) is None]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join('--' + name for name in missing)}")
+    main(args.input_clips, args.input_video, args.input_mp3, args.input_txt, Path(args.output_dir),args.font_file, args.font_size, args.font_color, args.bg_color, args.margin, args.render_backend, args.subtitle_roi, render_chunks=args.render_chunks, renditions=args.renditions)
 
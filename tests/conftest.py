@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline modules live in the repository root; put it first so 'test' is ours, not the standard library's
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
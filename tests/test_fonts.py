@@ -0,0 +1,43 @@
+import shutil
+
+import pytest
+
+pytest.importorskip('PIL')
+pytest.importorskip('moviepy.editor')
+if shutil.which('convert') is None:
+    pytest.skip("ImageMagick is not installed", allow_module_level=True)
+
+from fonts import list_fonts, measure_text, resolve_font_file
+from test import textclip_line_width
+
+LINES = [
+    "The quick brown fox jumps over the lazy dog.",
+    "AVATAR Tokyo, WAVE. LT Ty",
+    "Replacement scenes are uploaded one at a time.",
+    "fi fl ffi 1234567890 !?",
+]
+
+
+def sample_fonts():
+    fonts = list(list_fonts().items())[:3]
+    if not fonts:
+        pytest.skip("No fonts installed")
+    return fonts
+
+
+@pytest.mark.parametrize('font_size', [24, 36, 48])
+def test_measured_widths_match_textclip(font_size):
+    for _, font_path in sample_fonts():
+        for line in LINES:
+            expected = textclip_line_width(line, font_path, font_size)
+            assert abs(measure_text(font_path, font_size, line) - expected) <= 1, (font_path, line)
+
+
+def test_font_names_measure_like_textclip():
+    name, font_path = sample_fonts()[0]
+    assert resolve_font_file(name) == font_path
+    assert abs(measure_text(resolve_font_file(name), 36, LINES[0]) - textclip_line_width(LINES[0], name, 36)) <= 1
+
+
+def test_unknown_font_names_do_not_resolve():
+    assert resolve_font_file('No-Such-Font-Name') is None
@@ -0,0 +1,39 @@
+import logging
+import os
+import subprocess
+import sys
+
+PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code: str, cwd: str) -> str:
+    result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, check=True)
+    return result.stdout.decode('utf-8').strip()
+
+
+def test_importing_test_does_not_load_heavy_modules():
+    loaded = run_python(
+        "import sys, test; "
+        "print(','.join(name for name in ('cv2', 'moviepy', 'pysrt') if name in sys.modules))",
+        PIPELINE_DIR,
+    )
+    assert loaded == ''
+
+
+def test_warm_imports_resolves_test_to_the_pipeline():
+    # From another directory 'test' would be the standard library package
+    module_file = run_python(
+        f"import sys; sys.path.append({PIPELINE_DIR!r}); import workers; workers.warm_imports(); "
+        "print(sys.modules['test'].__file__)",
+        os.path.dirname(PIPELINE_DIR),
+    )
+    assert module_file == os.path.join(PIPELINE_DIR, 'test.py')
+
+
+def test_pool_workers_log_at_the_configured_level():
+    level = run_python(
+        "import logging, os, workers; os.environ['LOG_LEVEL'] = 'INFO'; pool = workers.make_process_pool(1); "
+        "print(pool.submit(logging.getLogger().getEffectiveLevel).result()); pool.shutdown()",
+        PIPELINE_DIR,
+    )
+    assert level == str(logging.INFO)
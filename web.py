@@ -1,17 +1,28 @@
 import os
 import uuid
 import datetime
-from flask import Flask, render_template_string, request, send_from_directory, redirect, url_for, session
-from threading import Thread
+from flask import Flask, render_template_string, request, redirect, url_for, session
+from threading import Lock, Thread
 import shutil
 from test import (
     load_subtitles_from_file, subriptime_to_seconds, load_video_from_file, 
-    concatenate_videoclips, get_segments_using_srt, generate_srt_from_txt_and_audio,
-    adjust_segment_duration,crop_to_aspect_ratio,replace_video_segments, split_by_computer_vision,
-    refine_subtitles_based_on_computer_vision
+    get_segments_using_srt, generate_srt_from_txt_and_audio,
+    adjust_segment_duration,crop_to_aspect_ratio,replace_video_segments, iter_subtitle_change_events,
+    log_scan_progress, refine_subtitles_based_on_computer_vision, parse_subtitle_roi, validate_subtitle_roi, configure_logging
     )
+from ffmpeg_backend import PREVIEW_HEIGHT, PREVIEW_VIDEO_ARGS, build_preview_plan, build_render_plan, probe_video, render_plan_with_ffmpeg
+from chunked_render import render_plan_chunked
+from frame_io import render_plan_zero_copy
+from fonts import register_font_upload
+from renditions import geometry_filters, parse_renditions, render_renditions_from_file, rendition_outputs, rendition_path
+from cache import CACHE_ROOT, file_hash, load_cached_json, save_cached_json
+from render_cache import cached_render, render_cache_key, render_entry_path, source_key
+from janitor import Janitor
+from keyframes import KEYFRAME_SNAP_SECONDS, get_keyframe_index
+from media import send_media_file
+from pipelined_writer import write_clip_pipelined
+from workers import RENDER_WORKERS, get_render_pool, prewarm_render_pool
 from pathlib import Path
-import pysrt
 import logging
 
 
@@ -21,6 +32,97 @@ GLITCH_IGNORE_THRESHOLD: float = 0.27
 app = Flask(__name__)
 app.secret_key = "supersecretkey"  # Needed for session management
 app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['RENDER_BACKEND'] = os.environ.get('RENDER_BACKEND', 'moviepy')  # 'moviepy', 'ffmpeg' or 'zerocopy'
+app.config['RENDER_CHUNKS'] = int(os.environ.get('RENDER_CHUNKS', '0'))  # > 1 renders chunks in parallel
+app.config['RENDITIONS'] = parse_renditions(os.environ.get('RENDITIONS', ''))  # e.g. 'feed,story,preview'
+
+# Workspaces, rendered outputs, uploaded scenes and cache entries, evicted by TTL and disk quota
+janitor = Janitor({
+    'tmp': 1,
+    'uploads': 1,
+    os.path.join('static', 'output_root', 'output', 'videos'): 1,
+    os.path.join('static', 'output_root', 'output', 'audios'): 1,
+    os.path.join('static', 'output_root', 'final'): 1,
+    str(CACHE_ROOT): 2,
+})
+
+# Sprite sheets and index of the editor's filmstrip, written by the background scan
+FILMSTRIP_PREFIX = Path('uploads') / 'filmstrip'
+# Every scan writes under its own prefix and only the latest one started is published to filmstrip.json
+filmstrip_lock = Lock()
+current_filmstrip_scan = None
+published_filmstrip_scan = None
+# source_key() of the video and subtitles uploaded last, recorded by process()
+global_upload_key = None
+# Held while the uploaded video and subtitles or the global settings change, renders replace them in place
+render_lock = Lock()
+
+
+def change_events_key(video_path, subtitle_roi) -> str:
+    roi = ','.join(str(subtitle_roi[side]) for side in ('top', 'bottom', 'left', 'right')) if subtitle_roi else 'auto'
+    return f"{file_hash(video_path)}_{roi}"
+
+
+def filmstrip_scan_prefix(scan_id: str) -> Path:
+    return FILMSTRIP_PREFIX.with_name(f"{FILMSTRIP_PREFIX.name}_{scan_id}")
+
+
+def remove_filmstrip_scan(scan_id: str):
+    prefix = filmstrip_scan_prefix(scan_id)
+    for path in prefix.parent.glob(f"{prefix.name}_*.jpg"):
+        path.unlink(missing_ok=True)
+    prefix.with_suffix('.json').unlink(missing_ok=True)
+
+
+def publish_filmstrip_scan(scan_id: str) -> bool:
+    """Make a finished scan's filmstrip the editor's, unless a newer scan has started since."""
+    global published_filmstrip_scan
+    with filmstrip_lock:
+        if scan_id != current_filmstrip_scan:
+            return False
+        os.replace(filmstrip_scan_prefix(scan_id).with_suffix('.json'), FILMSTRIP_PREFIX.with_suffix('.json'))
+        previous, published_filmstrip_scan = published_filmstrip_scan, scan_id
+    if previous is not None:
+        remove_filmstrip_scan(previous)
+    return True
+
+
+def scan_video_in_background(video_path, subtitles_path, subtitle_roi):
+    """Decode the video once to build the editor filmstrip and cache the change events for the next render."""
+    global current_filmstrip_scan
+    # Hash now, a render or upload may replace the file while the scan runs
+    events_key = change_events_key(video_path, subtitle_roi)
+    keyframes_key = file_hash(video_path) if KEYFRAME_SNAP_SECONDS > 0 else None
+    scan_id = uuid.uuid4().hex
+    with filmstrip_lock:
+        current_filmstrip_scan = scan_id
+    FILMSTRIP_PREFIX.with_suffix('.json').unlink(missing_ok=True)
+
+    def scan():
+        published = False
+        try:
+            with janitor.pinned(video_path, subtitles_path):
+                if keyframes_key is not None:
+                    # Renders and previews snap their cuts with it, so the first request does not scan the packets
+                    get_keyframe_index(video_path, keyframes_key)
+                subtitles = load_subtitles_from_file(Path(subtitles_path))
+                subtitle_windows = [
+                    (subriptime_to_seconds(subtitle.start), subriptime_to_seconds(subtitle.end)) for subtitle in subtitles
+                ]
+                events = list(iter_subtitle_change_events(
+                    Path(video_path), subtitle_roi, filmstrip=filmstrip_scan_prefix(scan_id),
+                    subtitle_windows=subtitle_windows
+                ))
+            save_cached_json('change_events', events_key, events)
+            published = publish_filmstrip_scan(scan_id)
+        except Exception as e:
+            logging.error(f"Background scan of {video_path} failed: {e}")
+        finally:
+            if not published:
+                remove_filmstrip_scan(scan_id)
+
+    Thread(target=scan, daemon=True).start()
+
 
 def generate_unique_id():
     return str(uuid.uuid4())
@@ -90,6 +192,7 @@ def index():
                     Font Size <input type="text" name="font_size" value="36" required><br>
                     Font Color <input type="text" name="font_color" value="#fffff2" equired><br>
                     Background Color <input type="text" name="bg_color" value="#000000" required><br>
+                    Subtitle Area (top,bottom,left,right) <input type="text" name="subtitle_roi" placeholder="auto"><br>
                     <input type="text" name="margin" value="26" readonly style="display: none;"><br>
                     <input type="submit" value="Process">
                 </form>
@@ -104,27 +207,14 @@ def index():
 @app.route('/process', methods=['POST'])
 def process():
     global global_font_size, global_box_color, global_bg_color, global_margin
-    global global_font_file_path
+    global global_font_file_path, global_subtitle_roi, global_upload_key
     
     static_out_file_server = os.path.join('static', 'output_root')
     tmp = os.path.join(os.getcwd(), 'tmp')
     final_out_path = os.path.join('static', 'output_root', 'final')
     outpath = os.path.join(static_out_file_server, 'output')
     
-    try:
-        # Cleanup old files
-        remove_all_files_in_directory(os.path.join(outpath, 'videos'))
-        remove_all_files_in_directory(os.path.join(outpath, 'audios'))
-        remove_all_files_in_directory(final_out_path)
-        
-        if os.path.exists(tmp):
-            tmp_dirs = os.listdir(tmp)
-            for dir in tmp_dirs:
-                remove_all_files_in_directory(os.path.join(tmp, dir))
-            remove_all_files_in_directory(tmp)
-    except Exception as e:
-        return f"An error occurred during cleanup: {e}", 500
-    
+    # Old workspaces and outputs are evicted by the background janitor, not here
     try:
         # Create necessary directories
         os.makedirs(outpath, exist_ok=True)
@@ -136,17 +226,16 @@ def process():
         return f"An error occurred during directory creation: {e}", 500
     
     unique_special_id = os.path.join(tmp, generate_unique_id())
+    janitor.touch(unique_special_id)
     
     video_dir = os.path.join(unique_special_id, "video")
     clips_dir = os.path.join(unique_special_id, "clips")
     mp3_dir = os.path.join(unique_special_id, "mp3")
     text_dir = os.path.join(unique_special_id, "text")
-    font_dir = os.path.join(unique_special_id, "font")
     os.makedirs(video_dir, exist_ok=True)
     os.makedirs(clips_dir, exist_ok=True)
     os.makedirs(mp3_dir, exist_ok=True)
     os.makedirs(text_dir, exist_ok=True)
-    os.makedirs(font_dir, exist_ok=True)
 
     try:
         # Save uploaded files
@@ -167,12 +256,12 @@ def process():
         video_file_path = os.path.join(video_dir, video_file.filename)
         mp3_file_path = os.path.join(mp3_dir, mp3_file.filename)
         text_file_path = os.path.join(text_dir, text_file.filename)
-        font_file_path = os.path.join(font_dir, font_file.filename)
         
         video_file.save(video_file_path)
         mp3_file.save(mp3_file_path)
         text_file.save(text_file_path)
-        font_file.save(font_file_path)
+        # Fonts are stored once per content hash and validated when first seen
+        font_file_path = str(register_font_upload(font_file))
         
         
         # Debug print to confirm files have been saved
@@ -182,29 +271,39 @@ def process():
         print(f"[DEBUG] Font File Saved: {font_file_path}", flush=True)
 
 
+    except ValueError as e:
+        return f"Invalid font file: {e}", 400
     except Exception as e:
         print(f"[ERROR] Failed to save files: {e}", flush=True)
         return f"An error occurred while saving files: {e}", 500
     
     
-    # New parameters
-    global_font_size = int(request.form.get('font_size'))
-    global_box_color = str(request.form.get('font_color'))
-    global_bg_color = str(request.form.get('bg_color'))
-    global_margin = int(request.form.get('margin', 20)) 
-    global_font_file_path = font_file_path
+    # New parameters, published to the globals together with the files once the upload is complete
+    font_size = int(request.form.get('font_size'))
+    box_color = str(request.form.get('font_color'))
+    bg_color = str(request.form.get('bg_color'))
+    margin = int(request.form.get('margin', 20)) 
+    try:
+        subtitle_roi = request.form.get('subtitle_roi', '').strip()
+        subtitle_roi = parse_subtitle_roi(subtitle_roi) if subtitle_roi else None
+        if subtitle_roi is not None:
+            geometry = probe_video(video_file_path)
+            validate_subtitle_roi(subtitle_roi, geometry['width'], geometry['height'])
+    except ValueError as e:
+        return f"Invalid subtitle area: {e}", 400
     
-    print(f"[DEBUG] Font Size: {global_font_size}", flush=True)
-    print(f"[DEBUG] Box Color: {global_box_color}", flush=True)
-    print(f"[DEBUG] Background Color: {global_bg_color}", flush=True)
-    print(f"[DEBUG] Margin: {global_margin}", flush=True)
+    print(f"[DEBUG] Font Size: {font_size}", flush=True)
+    print(f"[DEBUG] Box Color: {box_color}", flush=True)
+    print(f"[DEBUG] Background Color: {bg_color}", flush=True)
+    print(f"[DEBUG] Margin: {margin}", flush=True)
 
-    if not global_font_size or not global_box_color or not global_bg_color:
+    if not font_size or not box_color or not bg_color:
         return "Missing required form data", 400
 
     # Generate the SRT file from TXT and MP3 files
     try:
-        srt_file = generate_srt_from_txt_and_audio(Path(text_file_path), Path(mp3_file_path), Path(tmp))
+        with janitor.pinned(unique_special_id):
+            srt_file = generate_srt_from_txt_and_audio(Path(text_file_path), Path(mp3_file_path), Path(tmp))
     except Exception as e:
         return f"Failed to generate SRT file: {e}", 500
     
@@ -212,14 +311,28 @@ def process():
     # shutil.move(font_file_path, final_font_path)
 
 
-    # Move the SRT file to uploads directory for further processing
-    final_srt_path = os.path.join('uploads', 'original_subtitles.srt')
-    shutil.move(srt_file, final_srt_path)
-    
-    # Move the video file to uploads directory for further processing
-    final_video_path = os.path.join('uploads', 'original_video.mp4')
-    shutil.move(video_file_path, final_video_path)
-    
+    # Wait for a running render, it reads the settings and replaces the files below
+    with render_lock:
+        # Move the SRT file to uploads directory for further processing
+        final_srt_path = os.path.join('uploads', 'original_subtitles.srt')
+        shutil.move(srt_file, final_srt_path)
+        
+        # Move the video file to uploads directory for further processing
+        final_video_path = os.path.join('uploads', 'original_video.mp4')
+        shutil.move(video_file_path, final_video_path)
+
+        global_font_size = font_size
+        global_box_color = box_color
+        global_bg_color = bg_color
+        global_margin = margin
+        global_font_file_path = font_file_path
+        global_subtitle_roi = subtitle_roi
+
+        # Renders overwrite both files in place, so their identity is recorded now and carried forward in the session
+        global_upload_key = source_key(final_video_path, final_srt_path)
+        session['upload_key'] = session['source_key'] = global_upload_key
+
+        scan_video_in_background(final_video_path, final_srt_path, global_subtitle_roi)
     return redirect(url_for('video_processing_page'))
 
 @app.route('/video_processing')
@@ -309,6 +422,20 @@ def video_processing_page():
                     background-color: #218838;
                 }
 
+                .filmstrip {
+                    display: flex;
+                    flex-wrap: wrap;
+                    justify-content: center;
+                    gap: 6px;
+                    margin-bottom: 20px;
+                }
+
+                .filmstrip div {
+                    cursor: pointer;
+                    border-radius: 4px;
+                    border: 1px solid #ddd;
+                }
+
                 .spinner {
                     display: none;
                     width: 50px;
@@ -348,7 +475,7 @@ def video_processing_page():
                                         body: formData
                                     }).then(response => {
                                         if (response.ok) {
-                                            alert('Segment uploaded and stored for replacement.');
+                                            previewSegment(data.srt_index);
                                         } else {
                                             alert('Failed to upload the segment.');
                                         }
@@ -360,6 +487,65 @@ def video_processing_page():
                         .catch(error => console.error('Error:', error));
                 }
                 
+                function previewSegment(srtIndex) {
+                    let formData = new FormData();
+                    formData.append('srt_index', srtIndex);
+
+                    fetch('/preview_segment', {
+                        method: 'POST',
+                        body: formData
+                    }).then(response => {
+                        if (!response.ok) {
+                            alert('Segment uploaded, but the preview could not be rendered.');
+                            return;
+                        }
+                        return response.json().then(data => {
+                            let previewPlayer = document.getElementById('previewPlayer');
+                            previewPlayer.src = `${data.preview_url}?timestamp=${new Date().getTime()}`;
+                            previewPlayer.style.display = 'block';
+                            previewPlayer.load();
+                            previewPlayer.play();
+                        });
+                    }).catch(error => console.error('Error:', error));
+                }
+
+                // One thumbnail per sentence from the sprite sheets the server builds while scanning the video
+                function loadFilmstrip() {
+                    fetch(`/uploads/filmstrip.json?timestamp=${new Date().getTime()}`)
+                        .then(response => {
+                            if (!response.ok) {
+                                setTimeout(loadFilmstrip, 2000);
+                                return;
+                            }
+                            return response.json().then(index => {
+                                let filmstrip = document.getElementById('filmstrip');
+                                filmstrip.innerHTML = '';
+                                let shown = new Set();
+                                let version = new Date().getTime();
+                                index.tiles.forEach(tile => {
+                                    if (tile.srt_index === null || shown.has(tile.srt_index)) {
+                                        return;
+                                    }
+                                    shown.add(tile.srt_index);
+                                    let thumbnail = document.createElement('div');
+                                    thumbnail.style.width = `${index.tile_width}px`;
+                                    thumbnail.style.height = `${index.tile_height}px`;
+                                    thumbnail.style.background = `url(/uploads/${index.sheets[tile.sheet]}?timestamp=${version}) -${tile.x}px -${tile.y}px`;
+                                    thumbnail.title = `Sentence ${tile.srt_index + 1} (Shift-click to replace)`;
+                                    thumbnail.addEventListener('click', function(event) {
+                                        let videoPlayer = document.getElementById('videoPlayer');
+                                        videoPlayer.currentTime = tile.time;
+                                        if (event.shiftKey) {
+                                            getSceneIndex(tile.time);
+                                        }
+                                    });
+                                    filmstrip.appendChild(thumbnail);
+                                });
+                            });
+                        })
+                        .catch(error => console.error('Error:', error));
+                }
+
                 function processSegments() {
                     document.getElementById('spinner').style.display = 'block';  // Show the spinner
                     fetch('/process_video', {
@@ -372,6 +558,7 @@ def video_processing_page():
                             let newVideoSrc = `/uploads/original_video.mp4?timestamp=${new Date().getTime()}`;
                             videoPlayer.src = newVideoSrc;
                             videoPlayer.load();
+                            loadFilmstrip();
                             alert('Video compiled and segments replaced successfully!');
 
                             // Create a download button for the user to download the processed video
@@ -383,6 +570,18 @@ def video_processing_page():
 
                             let container = document.querySelector('.container');
                             container.appendChild(downloadButton);
+
+                            // One more download per rendition encoded in the same pass
+                            response.json().then(data => {
+                                for (const [name, url] of Object.entries(data.renditions)) {
+                                    let renditionButton = document.createElement('a');
+                                    renditionButton.href = `${url}?timestamp=${new Date().getTime()}`;
+                                    renditionButton.download = `processed_video_${name}.mp4`;
+                                    renditionButton.className = 'btn btn-primary';
+                                    renditionButton.textContent = `Download ${name}`;
+                                    container.appendChild(renditionButton);
+                                }
+                            });
                         } else {
                             alert('Failed to compile and replace segments.');
                         }
@@ -394,6 +593,7 @@ def video_processing_page():
                 }
 
                 document.addEventListener('DOMContentLoaded', function() {
+                    loadFilmstrip();
                     var videoPlayer = document.getElementById('videoPlayer');
                     videoPlayer.addEventListener('click', function(event) {
                         if (event.shiftKey) {
@@ -412,14 +612,19 @@ def video_processing_page():
                 Use this video editor to replace segments of the video. <br>
                 <strong>Instructions:</strong> <br>
                 - Play the video and pause it at the point you want to replace. <br>
-                - Hold <strong>Shift</strong> and click on the video to choose a new video segment to upload and replace the current segment.
+                - Hold <strong>Shift</strong> and click on the video to choose a new video segment to upload and replace the current segment. <br>
+                - Or click a sentence thumbnail to jump to it, and Shift-click it to replace that sentence.
             </p>
+            <div id="filmstrip" class="filmstrip"></div>
             <div class="video-container">
                 <video id="videoPlayer" controls>
                     <source src="/uploads/original_video.mp4" type="video/mp4">
                     Your browser does not support the video tag.
                 </video>
             </div>
+            <div class="video-container">
+                <video id="previewPlayer" controls style="display: none;"></video>
+            </div>
             <div id="spinner" class="spinner"></div> <!-- Loading Spinner -->
             <button class="btn btn-success" onclick="processSegments()">Process</button>
         </div>
@@ -442,21 +647,21 @@ def get_srt_index():
     
     return {"srt_index": -1}  # Return -1 if no matching subtitle is found
 
-def process_multiple_video_segment_replacements(original_video_path, subtitles_path, replacements, font_path, font_size, font_color, bg_color, margin):
+def process_multiple_video_segment_replacements(original_video_path, subtitles_path, replacements, font_path, font_size, font_color, bg_color, margin, render_backend='moviepy', subtitle_roi=None, render_chunks=0, renditions=None):
+    from moviepy.editor import concatenate_videoclips
+
     # Load original video and subtitles
     video = load_video_from_file(Path(original_video_path))
     subtitles = load_subtitles_from_file(Path(subtitles_path))
-    timestamps = split_by_computer_vision(Path(original_video_path))
+    # The background scan started after the previous upload or render usually has the events ready
+    change_events = load_cached_json('change_events', change_events_key(original_video_path, subtitle_roi))
+    if change_events is None:
+        change_events = iter_subtitle_change_events(Path(original_video_path), subtitle_roi, progress=log_scan_progress)
     
-    for ts in timestamps:
-        if ts['confidence'] > MAE_THRESHOLD:
-            logging.debug(f"Frame: {ts['frame_number']}, Timestamp: {ts['timestamp']}, Confidence: {ts['confidence']}")
     logging.info("Video loaded successfully")
-    cropped_video = crop_to_aspect_ratio(video, 4 / 5)
-    logging.info("Video cropped to desired aspect ratio")
     
     
-    refined_subtitles = refine_subtitles_based_on_computer_vision(subtitles, timestamps, replacements)
+    refined_subtitles = refine_subtitles_based_on_computer_vision(subtitles, change_events, replacements)
     refined_srt_file = Path(subtitles_path).with_name(Path(subtitles_path).stem + "_refined.srt")
     
     # Save the refined subtitles
@@ -472,6 +677,32 @@ def process_multiple_video_segment_replacements(original_video_path, subtitles_p
         logging.error(f"Error moving refined SRT file: {e}")
         raise
 
+    temp_final_video_path = Path('uploads') / 'temp_final_video.mp4'
+    if render_backend in ('ffmpeg', 'zerocopy') or render_chunks > 1:
+        plan = build_render_plan(
+            original_video_path,
+            refined_subtitles,
+            {replacement['srt_index']: replacement['scene_path'] for replacement in replacements},
+            font_path,
+            font_size,
+            font_color,
+            bg_color,
+            margin
+        )
+        # Renditions are written next to the edited video in the same pass
+        extra_outputs = rendition_outputs(original_video_path, renditions or [], plan['width'], plan['height'])
+        filter_outputs = [(path, geometry_filters(geometry)) for path, geometry in extra_outputs]
+        if render_chunks > 1:
+            render_plan_chunked(plan, temp_final_video_path, render_chunks, backend=render_backend)
+            if extra_outputs:
+                render_renditions_from_file(temp_final_video_path, extra_outputs, has_audio=plan['has_audio'])
+        elif render_backend == 'zerocopy':
+            render_plan_zero_copy(plan, temp_final_video_path, extra_outputs=filter_outputs)
+        else:
+            render_plan_with_ffmpeg(plan, temp_final_video_path, extra_outputs=filter_outputs)
+        os.replace(temp_final_video_path, original_video_path)
+        return "Success"
+
     # Segment the original video based on the subtitles
     video_segments, subtitle_segments = get_segments_using_srt(video, refined_subtitles)
 
@@ -510,12 +741,11 @@ def process_multiple_video_segment_replacements(original_video_path, subtitles_p
     final_video_with_audio = final_video.set_audio(original_audio)
 
     # Save the final video with all the replaced segments
-    temp_final_video_path = Path('uploads') / 'temp_final_video.mp4'
-    final_video_with_audio.write_videofile(temp_final_video_path.as_posix(), codec="libx264", audio_codec="aac")
+    extra_outputs = rendition_outputs(original_video_path, renditions or [], final_video_with_audio.w, final_video_with_audio.h)
+    write_clip_pipelined(final_video_with_audio, temp_final_video_path, extra_outputs=extra_outputs)
 
     # Replace the original video with the new one
-    os.remove(original_video_path)  # Remove the old file
-    temp_final_video_path.rename(original_video_path)  # Rename temp file to original path
+    os.replace(temp_final_video_path, original_video_path)
 
     return "Success"
 
@@ -534,28 +764,68 @@ def process_video():
     # Ensure we have replacements to process
     if not replacements:
         return "No segments to replace", 400
+    # Renders of different edits both replace the uploaded files, run them one at a time.
+    # Identical renders queue here too and are then restored from the render cache.
+    with render_lock:
+        if session.get('upload_key') is None or session['upload_key'] != global_upload_key:
+            return "The video was replaced by another upload, upload it again", 409
     
-    if not os.path.exists(global_font_file_path):
-        print(f"[ERROR] Font file not found at: {global_font_file_path}", flush=True)
-    else:
-        print(f"[ERROR] Font file was found at: {global_font_file_path}", flush=True)
-
-    # Process all replacements
-    process_multiple_video_segment_replacements(
-        original_video_path=original_video_path,
-        subtitles_path=subtitles_path,
-        replacements=replacements,
-        font_path=global_font_file_path,
-        font_size=int(global_font_size),
-        font_color=str(global_box_color),
-        bg_color=str(global_bg_color),
-        margin=int(global_margin)
-    )
-
-    # Clear the session replacements after processing
+        if not os.path.exists(global_font_file_path):
+            print(f"[ERROR] Font file not found at: {global_font_file_path}", flush=True)
+        else:
+            print(f"[ERROR] Font file was found at: {global_font_file_path}", flush=True)
+
+        # Process all replacements
+        render_kwargs = dict(
+            original_video_path=original_video_path,
+            subtitles_path=subtitles_path,
+            replacements=replacements,
+            font_path=global_font_file_path,
+            font_size=int(global_font_size),
+            font_color=str(global_box_color),
+            bg_color=str(global_bg_color),
+            margin=int(global_margin),
+            render_backend=request.form.get('render_backend', app.config['RENDER_BACKEND']),
+            subtitle_roi=global_subtitle_roi,
+            render_chunks=app.config['RENDER_CHUNKS'],
+            renditions=app.config['RENDITIONS']
+        )
+        job_files = [original_video_path, subtitles_path, global_font_file_path] + [r['scene_path'] for r in replacements]
+
+        def render():
+            if RENDER_WORKERS > 0:
+                # Run in a pre-warmed worker so the render does not pay for the heavy imports
+                get_render_pool().submit(process_multiple_video_segment_replacements, **render_kwargs).result()
+            else:
+                process_multiple_video_segment_replacements(**render_kwargs)
+
+        # The render overwrites the video and subtitles in place, so those are the outputs to store and restore
+        outputs = {'video': Path(original_video_path), 'subtitles': Path(subtitles_path)}
+        for name in app.config['RENDITIONS']:
+            outputs[f"rendition_{name}"] = rendition_path(original_video_path, name)
+        with janitor.pinned(*job_files):
+            # A repeated press still carries the session's source key from before the first render finished
+            key = render_cache_key(
+                session['source_key'], replacements, global_font_file_path,
+                {name: render_kwargs[name] for name in ('font_size', 'font_color', 'bg_color', 'margin')},
+                render_kwargs['render_backend'], render_kwargs['renditions'], global_subtitle_roi
+            )
+            with janitor.pinned(render_entry_path(key)):
+                result = cached_render(key, outputs, render)
+        logging.info(f"Render {key}: {result}")
+        # A joined render's owner already started the scan of the same output
+        if result != 'joined':
+            scan_video_in_background(original_video_path, subtitles_path, render_kwargs['subtitle_roi'])
+
+    # Clear the session replacements after processing, later edits start from this render's output
     session.pop('replacements', None)
+    session['source_key'] = key
 
-    return "Video processing and segment replacement completed successfully."
+    renditions = {
+        name: url_for('download_file', filename=rendition_path(original_video_path, name).name)
+        for name in app.config['RENDITIONS']
+    }
+    return {"message": "Video processing and segment replacement completed successfully.", "renditions": renditions}
 
 
 @app.route('/upload_new_scene', methods=['POST'])
@@ -565,6 +835,7 @@ def upload_new_scene():
 
     temp_scene_path = os.path.join('uploads', new_scene.filename)
     new_scene.save(temp_scene_path)
+    janitor.touch(temp_scene_path)
 
     # Store the replacement details in session
     if 'replacements' not in session:
@@ -591,9 +862,50 @@ def upload_new_scene():
 
 
 
+@app.route('/preview_segment', methods=['POST'])
+def preview_segment():
+    srt_index = int(request.form['srt_index'])
+    replacement = next((r for r in session.get('replacements', []) if r['srt_index'] == srt_index), None)
+    if replacement is None:
+        return "No replacement uploaded for this segment", 400
+
+    original_video_path = 'uploads/original_video.mp4'
+    subtitles = load_subtitles_from_file(Path('uploads/original_subtitles.srt'))
+    if not 0 <= srt_index < len(subtitles):
+        return "Invalid subtitle index", 400
+
+    # Only the chosen sentence is rendered, the full video is left untouched
+    preview_path = Path('uploads') / f"preview_{srt_index}.mp4"
+    start = datetime.datetime.now()
+    with janitor.pinned(original_video_path, replacement['scene_path'], global_font_file_path):
+        plan = build_preview_plan(
+            original_video_path,
+            subtitles,
+            srt_index,
+            replacement['scene_path'],
+            global_font_file_path,
+            int(global_font_size),
+            str(global_box_color),
+            str(global_bg_color),
+            int(global_margin)
+        )
+        output_filters = [f"scale=-2:{PREVIEW_HEIGHT}"] if plan['height'] > PREVIEW_HEIGHT else None
+        render_plan_with_ffmpeg(plan, preview_path, video_args=PREVIEW_VIDEO_ARGS, output_filters=output_filters)
+    janitor.touch(preview_path)
+    logging.info(f"Rendered preview of segment {srt_index} in {(datetime.datetime.now() - start).total_seconds():.2f}s")
+
+    return {"preview_url": url_for('download_file', filename=preview_path.name)}
+
+
 @app.route('/uploads/<filename>')
 def download_file(filename):
-    return send_from_directory('uploads', filename)
+    janitor.touch(os.path.join('uploads', filename))
+    return send_media_file('uploads', filename)
+
+
+@app.route('/metrics')
+def metrics():
+    return {"janitor": janitor.metrics()}
 
 def remove_all_files_in_directory(directory):
     if os.path.exists(directory):
@@ -610,4 +922,9 @@ def remove_all_files_in_directory(directory):
         print(f"Directory {directory} does not exist")
 
 if __name__ == '__main__':
-    app.run(debug=False, host='0.0.0.0')
+    configure_logging()
+    janitor.start()
+    if RENDER_WORKERS > 0:
+        prewarm_render_pool()
+    # Threaded so media requests (seeking in the editor) never wait behind a render
+    app.run(debug=False, host='0.0.0.0', threaded=True)
@@ -0,0 +1,85 @@
+import importlib
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import List, Optional
+
+# Imported once in the fork server, every render worker forked from it starts with them loaded
+PRELOAD_MODULES: List[str] = ['numpy', 'cv2', 'pysrt', 'moviepy.editor']
+# The fork server does not get our sys.path before preloading (and 'test' would resolve to the
+# standard library package), so the pipeline's own modules are imported in each worker instead
+PIPELINE_MODULES: List[str] = ['test', 'ffmpeg_backend']
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', '0'))
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+
+
+def warm_imports():
+    # Workers may start with another working directory, ours has to come before the standard library
+    if PIPELINE_DIR in sys.path:
+        sys.path.remove(PIPELINE_DIR)
+    sys.path.insert(0, PIPELINE_DIR)
+    # Workers do not inherit the parent's logging setup, their INFO messages would be dropped
+    from test import configure_logging
+
+    configure_logging()
+    for module_name in PRELOAD_MODULES + PIPELINE_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except ImportError as e:
+            logging.warning(f"Could not preload {module_name}: {e}")
+
+
+def make_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Create a pool whose workers are forked from a server that already imported the pipeline."""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(PRELOAD_MODULES)
+    else:
+        context = multiprocessing.get_context('spawn')
+    logging.info(f"Starting process pool with {max_workers} workers ({context.get_start_method()})")
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=warm_imports)
+
+
+def get_render_pool(max_workers: int = None) -> ProcessPoolExecutor:
+    """Return the shared pool of render workers."""
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = make_process_pool(max_workers or RENDER_WORKERS or os.cpu_count())
+    return _render_pool
+
+
+def prewarm_render_pool(max_workers: int = None):
+    """Start every worker now so the first job does not pay for process start and imports."""
+    pool = get_render_pool(max_workers)
+    wait([pool.submit(warm_imports) for _ in range(pool._max_workers)])
+
+
+def shutdown_render_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown()
+        _render_pool = None
+
+
+def measure_import_time(module_name: str = 'test') -> float:
+    """Import a module in a fresh interpreter and return the seconds it took."""
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module_name}; print(time.perf_counter() - start)"
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        cwd=PIPELINE_DIR, check=True
+    )
+    return float(result.stdout.decode('utf-8').strip())
+
+
+if __name__ == "__main__":
+    for module_name in sys.argv[1:] or ['test', 'web']:
+        print(f"{module_name}: {measure_import_time(module_name):.3f}s")